@@ -1,19 +1,69 @@
 # ai_client.py
 
-import ollama
-from gemini_api_client import GeminiApiClient
+import asyncio
+import functools
+import config
 from config import USE_GEMINI_API, OLLAMA_MODEL
 
+# Keep the Ollama model resident between calls so short prompts don't pay a reload
+OLLAMA_KEEP_ALIVE = "10m"
+# Smaller model for mechanical edits such as merging a code change; older configs without it use the main model
+OLLAMA_LIGHT_MODEL = getattr(config, 'OLLAMA_LIGHT_MODEL', None) or OLLAMA_MODEL
+
+_shared_client = None
+
 class AIClient:
     def __init__(self):
+        # Only the configured backend's SDK is imported; the Gemini SDK alone adds noticeably to start-up
         if USE_GEMINI_API:
+            from gemini_api_client import GeminiApiClient
             self.client = GeminiApiClient()
         else:
+            import ollama
+            # ollama.Client holds a single pooled HTTP session for its lifetime
             self.client = ollama.Client()
 
-    def generate(self, prompt):
+    def model_name(self, light=False):
+        if USE_GEMINI_API:
+            return config.GEMINI_MODEL
+        return OLLAMA_LIGHT_MODEL if light else OLLAMA_MODEL
+
+    def generate(self, prompt, system=None, temperature=None, max_tokens=None, stop=None, light=False):
+        # Static instructions travel separately from the per-request prompt and always come first,
+        # so the backend sees an identical prefix across calls and can reuse its cached prefill
         if USE_GEMINI_API:
-            return self.client.generate(prompt)
+            settings = {}
+            if temperature is not None:
+                settings['temperature'] = temperature
+            if max_tokens:
+                settings['max_output_tokens'] = max_tokens
+            if stop:
+                settings['stop_sequences'] = stop
+            return self.client.generate(f"{system}\n\n{prompt}" if system else prompt, **settings)
         else:
-            response = self.client.generate(model=OLLAMA_MODEL, prompt=prompt)
-            return response  # Return the full response object
\ No newline at end of file
+            options = {}
+            if temperature is not None:
+                options['temperature'] = temperature
+            if max_tokens:
+                options['num_predict'] = max_tokens
+            if stop:
+                options['stop'] = stop
+            response = self.client.generate(model=self.model_name(light), prompt=prompt, system=system or '', options=options or None, keep_alive=OLLAMA_KEEP_ALIVE)
+            return response  # Return the full response object
+
+    async def agenerate(self, prompt, system=None, temperature=None, max_tokens=None, stop=None, light=False):
+        # Both SDKs are synchronous, so run the blocking call on the default executor
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(
+            self.generate, prompt, system=system, temperature=temperature, max_tokens=max_tokens, stop=stop, light=light
+        ))
+
+def get_ai_client() -> AIClient:
+    """
+    Return the process-wide AIClient, creating it on first use.
+    Sharing one instance lets every caller reuse the same HTTP connection pool.
+    """
+    global _shared_client
+    if _shared_client is None:
+        _shared_client = AIClient()
+    return _shared_client
\ No newline at end of file
@@ -4,7 +4,7 @@ import os
 import subprocess
 from typing import Dict, List, Optional, Tuple, Any
 from project_context_manager import ProjectContextManager
-from ai_client import AIClient
+from ai_client import AIClient, get_ai_client
 import re
 from utils import strip_const_declarations
 
@@ -12,6 +12,11 @@ MAX_RETRIES = 3
 RETRY_DELAY = 5
 MAX_CONTEXT_LENGTH = 100000
 
+PLACEHOLDER_PATTERN = re.compile(r'<[A-Z_]{3,}>|```')
+
+# How often validate_file_structure could skip its LLM round-trip
+structure_check_stats = {"skipped": 0, "llm_validated": 0}
+
 def generate_code(client: AIClient, task: Dict[str, Any], project_context_manager: ProjectContextManager) -> Tuple[List[str], Dict[str, str]]:
     print(f"\nInitiating code generation for task: {task['main_task']}")
     print(f"\n--- Generating code for task: {task['main_task']} ---")
@@ -498,7 +503,7 @@ def correct_json(invalid_json: str) -> str:
     """
 
     try:
-        client = AIClient()
+        client = get_ai_client()
         response = client.generate( prompt=correction_prompt)
         return response['response'].strip()
     except Exception as e:
@@ -616,7 +621,29 @@ def check_existing_files(client: AIClient, task: str, project_files: Dict[str, s
         print(f"Error checking existing files: {e}")
         return ['lib/main.dart']
 
+def _looks_structurally_valid(content: str) -> bool:
+    """
+    Cheap local check for Dart files that are most likely already well formed:
+    balanced braces and parentheses, a class or main entry point, a proper ending
+    and no leftover placeholders or markdown fences.
+    """
+    stripped = content.strip()
+    if not stripped:
+        return False
+    if content.count('{') != content.count('}') or content.count('(') != content.count(')'):
+        return False
+    if 'class ' not in content and 'void main' not in content:
+        return False
+    if not stripped.endswith(('}', ';')):
+        return False
+    return not PLACEHOLDER_PATTERN.search(content)
+
 def validate_file_structure(client: AIClient, file_path: str, file_content: str) -> str:
+    if _looks_structurally_valid(file_content):
+        structure_check_stats["skipped"] += 1
+        return file_content
+    structure_check_stats["llm_validated"] += 1
+
     prompt = f"""
     Validate and correct the structure of the following Dart file:
 
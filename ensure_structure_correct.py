@@ -2,7 +2,6 @@ import os
 import json
 import re
 from typing import Dict, List, Any
-import ollama
 import tempfile
 import logging
 from ai_client import AIClient
@@ -72,8 +72,8 @@ def run_flutter_app(device_id: str, client: 'AIClient', project_files: Dict[str,
     os.chdir(project_root)
 
     # Run the Flutter app
-    command = f"flutter run -d {device_id}"
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, text=True)
+    command = ['flutter', 'run', '-d', device_id]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE, text=True)
 
     # Start a thread to handle the Flutter process output
     output_thread = threading.Thread(target=handle_flutter_output, args=(process, client, project_files))
@@ -2,6 +2,7 @@ import json
 import os
 from typing import Dict, List, Any
 from ai_client import AIClient
+from utils import walk_dart_files
 
 class FlutterProjectManager:
     def __init__(self, client: AIClient, project_root: str):
@@ -11,13 +12,11 @@ class FlutterProjectManager:
 
     def _analyze_project_structure(self) -> Dict[str, Any]:
         structure = {}
-        for root, dirs, files in os.walk(os.path.join(self.project_root, 'lib')):
-            for file in files:
-                if file.endswith('.dart'):
-                    relative_path = os.path.relpath(os.path.join(root, file), self.project_root)
-                    with open(os.path.join(root, file), 'r') as f:
-                        content = f.read()
-                    structure[relative_path] = content
+        for file_path in walk_dart_files(os.path.join(self.project_root, 'lib')):
+            relative_path = os.path.relpath(file_path, self.project_root)
+            with open(file_path, 'r') as f:
+                content = f.read()
+            structure[relative_path] = content
         return structure
 
     def update_project(self, task: Dict[str, Any]) -> None:
@@ -1,12 +1,13 @@
 import os
-import json
 import re
 import logging
 from typing import Dict, List, Any, Tuple
 import tempfile
 import subprocess
+import orjson
 from config import SKIP_DART_ANALYSIS
 from ai_client import AIClient
+from utils import strip_code_fences, to_json, write_file_atomic
 
 logger = logging.getLogger(__name__)
 
@@ -128,7 +129,7 @@ class FlutterProjectValidator:
         """
 
         response = self.client.generate( prompt=prompt)
-        return json.loads(response['response'])
+        return orjson.loads(response['response'])
 
     def resolve_integrity_issues(self, original_code: str, new_code: str, file_path: str) -> str:
         prompt = f"""
@@ -165,7 +166,7 @@ class FlutterProjectValidator:
         Generate complete and correct Dart code for the file {file_path} in a Flutter project.
         Ensure the code is consistent with the following project context:
 
-        {json.dumps(project_context, indent=2)}
+        {to_json(project_context, indent=True)}
 
         Provide only the Dart code, without any markdown code block syntax.
         """
@@ -174,9 +175,7 @@ class FlutterProjectValidator:
         return self.remove_code_markers(response['response'])
 
     def remove_code_markers(self, content: str) -> str:
-        content = re.sub(r'^```dart\n', '', content)
-        content = re.sub(r'\n```$', '', content)
-        return content.strip()
+        return strip_code_fences(content)
 
     def validate_and_connect_files(self, project_root: str, project_files: Dict[str, str], tasks: List[Dict[str, Any]]):
         logger.info("Validating and connecting Flutter project files...")
@@ -204,7 +203,7 @@ class FlutterProjectValidator:
     def analyze_project_context(self, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
         prompt = f"""
         Analyze the following tasks and subtasks for a Flutter project:
-        {json.dumps(tasks, indent=2)}
+        {to_json(tasks, indent=True)}
 
         Provide a high-level overview of the project structure and functionality.
         Include information about:
@@ -225,8 +224,8 @@ class FlutterProjectValidator:
         prompt = f"""
         Based on the following project context and screen files, determine the main entry point (home screen) and the necessary routes for the Flutter app:
 
-        Project context: {json.dumps(project_context, indent=2)}
-        Screen files: {json.dumps(screens, indent=2)}
+        Project context: {to_json(project_context, indent=True)}
+        Screen files: {to_json(screens, indent=True)}
 
         Return a JSON object with two keys:
         1. "entry_point": The file path of the main entry point (home screen)
@@ -254,8 +253,8 @@ class FlutterProjectValidator:
         Create or update the main.dart file for a Flutter app with the following specifications:
 
         Entry point: {entry_point}
-        Routes: {json.dumps(routes, indent=2)}
-        Project context: {json.dumps(project_context, indent=2)}
+        Routes: {to_json(routes, indent=True)}
+        Project context: {to_json(project_context, indent=True)}
 
         Ensure that:
         1. All necessary imports are included
@@ -275,8 +274,7 @@ class FlutterProjectValidator:
         updated_content = self.extract_code_from_response(response['response'])
 
         project_files['lib/main.dart'] = updated_content
-        with open(main_dart_path, 'w') as f:
-            f.write(updated_content)
+        write_file_atomic(main_dart_path, updated_content)
         logger.info("Created or updated main.dart with project structure")
 
     def validate_and_update_file(self, project_root: str, file_path: str, project_files: Dict[str, str], project_context: Dict[str, Any]):
@@ -284,7 +282,7 @@ class FlutterProjectValidator:
 
         prompt = f"""
         Validate and update the following Dart file content for {file_path}, considering this project context:
-        {json.dumps(project_context, indent=2)}
+        {to_json(project_context, indent=True)}
 
         Ensure that:
         1. All necessary imports are present
@@ -305,14 +303,13 @@ class FlutterProjectValidator:
 
         project_files[file_path] = updated_content
         full_path = os.path.join(project_root, file_path)
-        with open(full_path, 'w') as f:
-            f.write(updated_content)
+        write_file_atomic(full_path, updated_content)
         logger.info(f"Validated and updated: {file_path}")
 
     def ensure_project_integration(self, project_root: str, project_files: Dict[str, str], project_context: Dict[str, Any]):
         prompt = f"""
         Review the entire Flutter project structure and ensure proper integration between all components.
-        Project context: {json.dumps(project_context, indent=2)}
+        Project context: {to_json(project_context, indent=True)}
 
         Files in the project:
         {', '.join(project_files.keys())}
@@ -330,8 +327,7 @@ class FlutterProjectValidator:
                 updated_content = self.apply_integration_changes(content, changes)
                 project_files[file_path] = updated_content
                 full_path = os.path.join(project_root, file_path)
-                with open(full_path, 'w') as f:
-                    f.write(updated_content)
+                write_file_atomic(full_path, updated_content)
                 logger.info(f"Applied integration changes to: {file_path}")
 
     def apply_integration_changes(self, content: str, changes: str) -> str:
@@ -357,13 +353,13 @@ class FlutterProjectValidator:
 
     def parse_llm_json_response(self, response: str) -> Dict:
         try:
-            return json.loads(response)
-        except json.JSONDecodeError:
+            return orjson.loads(response)
+        except orjson.JSONDecodeError:
             match = re.search(r'\{.*\}|\[.*\]', response, re.DOTALL)
             if match:
                 try:
-                    return json.loads(match.group(0))
-                except json.JSONDecodeError:
+                    return orjson.loads(match.group(0))
+                except orjson.JSONDecodeError:
                     pass
         logger.error(f"Failed to parse JSON from LLM response: {response}")
         return {}
\ No newline at end of file
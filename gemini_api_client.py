@@ -11,15 +11,16 @@ class GeminiApiClient:
         configure(api_key=GEMINI_API_KEY)
         self.model = GenerativeModel(model_name=GEMINI_MODEL)
 
-    def generate(self, prompt):
+    def generate(self, prompt, temperature=0.7, max_output_tokens=2048, stop_sequences=None):
         try:
             response = self.model.generate_content(
                 prompt,
                 generation_config=GenerationConfig(
-                    temperature=0.7,
+                    temperature=temperature,
                     top_p=1,
                     top_k=1,
-                    max_output_tokens=2048,
+                    max_output_tokens=max_output_tokens,
+                    stop_sequences=stop_sequences,
                 )
             )
 
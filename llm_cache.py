@@ -0,0 +1,107 @@
+# llm_cache.py
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+import diskcache
+
+logger = logging.getLogger(__name__)
+
+MAX_CACHE_ENTRIES = 256
+# Next to the bot's own sources; the working directory is the generated Flutter app by the time caches open
+LLM_DISK_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.llm_cache')
+
+def _digest(text: str) -> str:
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+class LLMCache:
+    """
+    In-memory LRU cache in front of an LLM generate call.
+    Responses are keyed on the exact prompt, system prompt, model namespace and generation
+    options; Dart code is case- and often whitespace-sensitive, so nothing is normalized.
+    With disk_dir set, responses are also kept on disk so re-runs and resumed builds can reuse them.
+    """
+    def __init__(self, max_entries: int = MAX_CACHE_ENTRIES, disk_dir: Optional[str] = None, namespace: str = ''):
+        self.max_entries = max_entries
+        # Keeps answers from different models apart when they share a disk cache
+        self.namespace = namespace
+        self._disk = diskcache.Cache(disk_dir) if disk_dir else None
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, prompt: str, system: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> str:
+        settings = ",".join(f"{name}={options[name]!r}" for name in sorted(options or {}))
+        return _digest(f"{self.namespace}\x00{settings}\x00{system or ''}\x00{prompt}")
+
+    def get(self, prompt: str, system: Optional[str] = None, options: Optional[Dict[str, Any]] = None) -> Any:
+        key = self._key(prompt, system, options)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+        if self._disk is not None:
+            response = self._disk.get(key)
+            if response is not None:
+                with self._lock:
+                    self._entries[key] = response
+                    self.hits += 1
+                return response
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, prompt: str, response: Any, system: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        key = self._key(prompt, system, options)
+        with self._lock:
+            self._entries[key] = response
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self._disk is not None:
+            self._disk.set(key, response)
+
+    def stats(self) -> str:
+        with self._lock:
+            total = self.hits + self.misses
+            rate = (100.0 * self.hits / total) if total else 0.0
+            return f"{self.hits} hits / {self.misses} misses ({rate:.0f}% hit rate)"
+
+    def invalidate(self, prompt: str, system: Optional[str] = None, options: Optional[Dict[str, Any]] = None):
+        """Drop a cached response, e.g. when it failed validation and the caller retries."""
+        key = self._key(prompt, system, options)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._disk is not None:
+            self._disk.delete(key)
+
+    def get_or_generate(self, prompt: str, generate: Callable[..., Any], system: Optional[str] = None,
+                        options: Optional[Dict[str, Any]] = None) -> Any:
+        """Return the cached response, or call generate(prompt=..., system=..., **options) and cache it."""
+        response = self.get(prompt, system, options)
+        if response is not None:
+            logger.debug("LLM cache hit")
+            return response
+        kwargs = dict(options or {})
+        if system is not None:
+            kwargs['system'] = system
+        response = generate(prompt=prompt, **kwargs)
+        self.put(prompt, response, system, options)
+        return response
+
+    async def aget_or_generate(self, prompt: str, agenerate: Callable[..., Awaitable[Any]], system: Optional[str] = None,
+                               options: Optional[Dict[str, Any]] = None) -> Any:
+        response = self.get(prompt, system, options)
+        if response is not None:
+            logger.debug("LLM cache hit")
+            return response
+        kwargs = dict(options or {})
+        if system is not None:
+            kwargs['system'] = system
+        response = await agenerate(prompt=prompt, **kwargs)
+        self.put(prompt, response, system, options)
+        return response
@@ -1,26 +1,27 @@
+import argparse
 import os
+import queue
 import subprocess
+import threading
 import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Tuple, Optional, Any, Set
-import json
+import orjson
 import ollama
-from project_management import select_or_create_project, get_project_structure
-from flutter_integration import check_flutter_installation, enable_flutter_web_support, get_available_devices, run_flutter_app, hot_reload, full_restart
-from code_generation import generate_code, validate_file_structure, apply_code_changes
-from error_handling import update_project_files
-from utils import run_command
+from project_management import select_or_create_project
+from flutter_integration import check_flutter_installation, enable_flutter_web_support, get_available_devices, run_flutter_app, hot_reload
+from code_generation import validate_file_structure
+from utils import strip_const_declarations, to_json, write_file_atomic
 from task_planning import TaskPlanner
 from ensure_structure_correct import ensure_correct_structure
 import logging
 import pickle
-import traceback
-from ensure_structure_correct import ensure_correct_structure, validate_dart_code, fix_dart_code
 from project_context_manager import ProjectContextManager
 from flutter_project_validator import FlutterProjectValidator
-from ai_client import AIClient
-from config import SKIP_DART_ANALYSIS, USE_GEMINI_API, USE_DART_VALIDATOR
+from ai_client import AIClient, get_ai_client
+from config import SKIP_DART_ANALYSIS, USE_DART_VALIDATOR
 from task_context import TaskContext
-from utils import strip_const_declarations
 
 from task_review_manager import TaskReviewManager
 
@@ -28,6 +29,14 @@ from task_review_manager import TaskReviewManager
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+MAX_STEP_WORKERS = 8
+ERROR_WAIT_SECONDS = 2.0
+# Stop collecting error output once stderr has been quiet this long
+ERROR_QUIET_SECONDS = 0.25
+
+# One stderr reader per Flutter process; its lines end up in the queue, and None marks EOF
+_stderr_queues: "weakref.WeakKeyDictionary[subprocess.Popen, queue.Queue]" = weakref.WeakKeyDictionary()
+
 def safe_validate_code(flutter_validator, original_content: str, new_content: str, file_path: str) -> bool:
     """Safely validate code changes when validator might be disabled"""
     if not flutter_validator:
@@ -82,15 +91,17 @@ def apply_code_changes(client: ollama.Client, new_directories: List[str], genera
         os.makedirs(full_dir_path, exist_ok=True)
         print(f"Created directory: {dir_path}")
 
+    full_paths = {file_path: os.path.join(project_root, file_path) for file_path in generated_updates}
+    for directory in {os.path.dirname(full_path) for full_path in full_paths.values()}:
+        os.makedirs(directory, exist_ok=True)
+
     for file_path, updated_content in generated_updates.items():
-        full_path = os.path.join(project_root, file_path)
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        full_path = full_paths[file_path]
 
         # Validate and correct file structure
         validated_content = validate_file_structure(client, file_path, updated_content)
 
-        with open(full_path, 'w') as f:
-            f.write(validated_content)
+        write_file_atomic(full_path, validated_content)
         project_files[file_path] = validated_content
         print(f"Updated file: {file_path}")
 
@@ -104,8 +115,7 @@ def apply_code_changes(client: ollama.Client, new_directories: List[str], genera
                 corrected_code = correct_code(client, error_message, file_path, validated_content)
                 if corrected_code:
                     print("Applying corrected code...")
-                    with open(full_path, 'w') as f:
-                        f.write(corrected_code)
+                    write_file_atomic(full_path, corrected_code)
                     project_files[file_path] = corrected_code
                     print(f"Updated file with corrected code: {file_path}")
                     hot_reload(flutter_process)
@@ -118,18 +128,46 @@ def apply_code_changes(client: ollama.Client, new_directories: List[str], genera
     else:
         print("Flutter process not available. Skipping hot reload.")
 
-def check_for_errors(flutter_process: subprocess.Popen) -> Optional[str]:
-    time.sleep(2)  # Wait for potential error messages
-    if flutter_process.poll() is not None:
-        return "Flutter process terminated unexpectedly."
+def _read_lines_into(pipe, lines: "queue.Queue"):
+    for line in iter(pipe.readline, ''):
+        lines.put(line)
+    lines.put(None)
 
+def _stderr_queue(flutter_process: subprocess.Popen) -> "queue.Queue":
+    # Reading on a thread sees every line, including ones already sitting in Python's buffer
+    lines = _stderr_queues.get(flutter_process)
+    if lines is None:
+        lines = queue.Queue()
+        _stderr_queues[flutter_process] = lines
+        threading.Thread(target=_read_lines_into, args=(flutter_process.stderr, lines), daemon=True).start()
+    return lines
+
+def check_for_errors(flutter_process: subprocess.Popen) -> Optional[str]:
+    # Collect what stderr has to say, returning as soon as an error is seen or it goes quiet
+    deadline = time.monotonic() + ERROR_WAIT_SECONDS
+    error_lines = []
     try:
-        error_output = flutter_process.stderr.read()
-        if error_output:
-            return error_output.decode('utf-8')
+        lines = _stderr_queue(flutter_process)
+        while True:
+            if flutter_process.poll() is not None and lines.empty():
+                return "Flutter process terminated unexpectedly."
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                line = lines.get(timeout=min(ERROR_QUIET_SECONDS, remaining))
+            except queue.Empty:
+                break
+            if line is None:
+                break
+            error_lines.append(line)
+            if 'Error:' in line or 'Exception' in line:
+                break
     except Exception as e:
         return f"Error checking for errors: {str(e)}"
 
+    if error_lines:
+        return ''.join(error_lines)
     return None
 
 def correct_code(client: ollama.Client, error_message: str, file_path: str, current_content: str) -> Optional[str]:
@@ -147,7 +185,7 @@ def correct_code(client: ollama.Client, error_message: str, file_path: str, curr
 
     try:
         response = client.generate(prompt=prompt)
-        generated_code = json.loads(response['response'])
+        generated_code = orjson.loads(response['response'])
         return generated_code.get("code")
     except Exception as e:
         print(f"Error generating corrected code: {e}")
@@ -160,29 +198,100 @@ def check_and_add_dependencies(project_root: str, generated_updates: Dict[str, s
         imports = [line.split()[1].strip("';") for line in file_content.split('\n') if line.strip().startswith('import "package:')]
         new_dependencies.update(import_path.split('/')[0] for import_path in imports if import_path.split('/')[0] not in installed_packages and import_path.split('/')[0] not in ['flutter', 'dart'])
 
-    for dependency in new_dependencies:
-        if dependency not in installed_packages:
-            logger.info(f"Adding new dependency: {dependency}")
-            try:
-                subprocess.run(['flutter', 'pub', 'add', dependency], cwd=project_root, check=True)
-                installed_packages.add(dependency)
-                logger.info(f"Successfully added {dependency}")
-            except subprocess.CalledProcessError as e:
-                logger.error(f"Failed to add package {dependency}. Error: {e}")
-
-    if new_dependencies:
-        logger.info("Running flutter pub get...")
+    missing = [dependency for dependency in new_dependencies if dependency not in installed_packages]
+    if missing:
+        # One `pub add` resolves every package at once and already runs `pub get`
+        logger.info(f"Adding new dependencies: {', '.join(missing)}")
         try:
-            subprocess.run(['flutter', 'pub', 'get'], cwd=project_root, check=True)
-            logger.info("Successfully ran flutter pub get")
+            subprocess.run(['flutter', 'pub', 'add', *missing], cwd=project_root, check=True)
+            installed_packages.update(missing)
+            logger.info(f"Successfully added {', '.join(missing)}")
         except subprocess.CalledProcessError as e:
-            logger.error(f"Failed to run flutter pub get. Error: {e}")
+            logger.error(f"Failed to add packages together. Error: {e}")
+            for dependency in missing:
+                logger.info(f"Adding new dependency: {dependency}")
+                try:
+                    subprocess.run(['flutter', 'pub', 'add', dependency], cwd=project_root, check=True)
+                    installed_packages.add(dependency)
+                    logger.info(f"Successfully added {dependency}")
+                except subprocess.CalledProcessError as e:
+                    logger.error(f"Failed to add package {dependency}. Error: {e}")
+
+            logger.info("Running flutter pub get...")
+            try:
+                subprocess.run(['flutter', 'pub', 'get'], cwd=project_root, check=True)
+                logger.info("Successfully ran flutter pub get")
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Failed to run flutter pub get. Error: {e}")
     return list(new_dependencies)
 
-def development_loop(client: AIClient, project_root: str, flutter_process: subprocess.Popen, selected_device: str):
-    task_planner = TaskPlanner(client)
+def group_independent_steps(steps: List[Dict[str, Any]], existing_files: Set[str]) -> List[List[Dict[str, Any]]]:
+    """
+    Split task plan steps into groups that can be processed concurrently.
+    Create/update steps share a group unless they touch the same file or one step's
+    description mentions another step's file; every other step type runs on its own.
+    A step that creates a file closes its group, since the steps after it must see that file
+    in the project listing just as they would when run one by one.
+    """
+    groups = []
+    current_group = []
+    known_files = set(existing_files)
+
+    def depends_on_group(step: Dict[str, Any]) -> bool:
+        step_name = os.path.basename(step['file_path'])
+        for other in current_group:
+            other_name = os.path.basename(other['file_path'])
+            if (step['file_path'] == other['file_path'] or
+                    other_name in step.get('description', '') or
+                    step_name in other.get('description', '')):
+                return True
+        return False
+
+    for step in steps:
+        if step['type'] not in ['create_file', 'update_file']:
+            if current_group:
+                groups.append(current_group)
+                current_group = []
+            groups.append([step])
+            if step['type'] == 'delete_file':
+                known_files.discard(step['file_path'])
+            continue
+        if depends_on_group(step):
+            groups.append(current_group)
+            current_group = []
+        current_group.append(step)
+        if step['file_path'] not in known_files:
+            known_files.add(step['file_path'])
+            groups.append(current_group)
+            current_group = []
+
+    if current_group:
+        groups.append(current_group)
+    return groups
+
+def process_step(task_planner: TaskPlanner, flutter_validator, project_context_manager: ProjectContextManager, step: Dict[str, Any]) -> Tuple[str, str, bool]:
+    """Generate and validate the content for a single create/update step without touching the project."""
+    file_path = step['file_path']
+    content = task_planner.generate_file_content(file_path, step['description'], project_context_manager.file_contents)
+    if SKIP_DART_ANALYSIS:
+        validated_content = content
+    else:
+        validated_content = flutter_validator.validate_and_fix_dart_code(content, file_path)
+
+    integrity_ok = True
+    if file_path in project_context_manager.file_contents:
+        integrity_ok = safe_validate_code(
+            flutter_validator,
+            project_context_manager.file_contents.get(file_path, ""),
+            validated_content,
+            file_path
+        )
+    return file_path, validated_content, integrity_ok
+
+def development_loop(client: AIClient, project_root: str, flutter_process: subprocess.Popen, selected_device: str, use_disk_cache: bool = True):
+    task_planner = TaskPlanner(client, use_disk_cache=use_disk_cache)
     project_context_manager = ProjectContextManager(project_root)
-    review_manager = TaskReviewManager(client)  # Add this line
+    review_manager = TaskReviewManager(client, use_disk_cache=use_disk_cache)
     task_context = TaskContext()
     logger.info(f"USE_DART_VALIDATOR setting: {USE_DART_VALIDATOR}")
     flutter_validator = FlutterProjectValidator(client) if USE_DART_VALIDATOR else None
@@ -209,11 +318,12 @@ def development_loop(client: AIClient, project_root: str, flutter_process: subpr
 
         try:
             task_plan = task_planner.generate_task_plan(user_input, project_context_manager.file_contents)
-            logger.info(f"Generated task plan: {json.dumps(task_plan, indent=2)}")
+            logger.info("Generated task plan: %s", to_json(task_plan, indent=True))
             task_plan = review_manager.review_task_plan(task_plan, user_input)
-            logger.info(f"Enhanced task plan: {json.dumps(task_plan, indent=2)}")
+            task_plan_json = to_json(task_plan, indent=True)
+            logger.info("Enhanced task plan: %s", task_plan_json)
 
-            print(f"Task plan: {json.dumps(task_plan, indent=2)}")
+            print(f"Task plan: {task_plan_json}")
 
             if not task_plan or 'steps' not in task_plan:
                 logger.error("Invalid task plan generated. Attempting to generate a simplified plan...")
@@ -225,22 +335,25 @@ def development_loop(client: AIClient, project_root: str, flutter_process: subpr
                 else:
                     print("A simplified task plan has been generated. Some complex features may be omitted.")
 
-            for step in task_plan['steps']:
-                file_path = step['file_path']
-                if step['type'] in ['create_file', 'update_file']:
-                    content = task_planner.generate_file_content(file_path, step['description'], project_context_manager.file_contents)
-                    if SKIP_DART_ANALYSIS:
-                        validated_content = content
-                    else:
-                        validated_content = flutter_validator.validate_and_fix_dart_code(content, file_path)
+            for step_group in group_independent_steps(task_plan['steps'], set(project_context_manager.file_contents)):
+                if step_group[0]['type'] not in ['create_file', 'update_file']:
+                    step = step_group[0]
+                    if step['type'] == 'delete_file':
+                        project_context_manager.delete_file(step['file_path'])
+                        logger.info(f"Deleted file: {step['file_path']}")
+                    continue
+
+                # LLM calls are I/O-bound, so independent steps can run side by side
+                with ThreadPoolExecutor(max_workers=min(MAX_STEP_WORKERS, len(step_group))) as executor:
+                    results = list(executor.map(
+                        lambda step: process_step(task_planner, flutter_validator, project_context_manager, step),
+                        step_group
+                    ))
 
+                # ProjectContextManager is not thread-safe, so apply results one at a time
+                for step, (file_path, validated_content, integrity_ok) in zip(step_group, results):
                     if file_path in project_context_manager.file_contents:
-                        if safe_validate_code(
-                            flutter_validator,
-                            project_context_manager.file_contents.get(file_path, ""),
-                            validated_content,
-                            file_path
-                        ):
+                        if integrity_ok:
                             project_context_manager.update_file(file_path, validated_content)
                             logger.info(f"{'Created' if step['type'] == 'create_file' else 'Updated'} file: {file_path}")
                         else:
@@ -249,9 +362,6 @@ def development_loop(client: AIClient, project_root: str, flutter_process: subpr
                         # New file creation
                         project_context_manager.update_file(file_path, validated_content)
                         logger.info(f"Created new file: {file_path}")
-                elif step['type'] == 'delete_file':
-                    project_context_manager.delete_file(file_path)
-                    logger.info(f"Deleted file: {file_path}")
 
             # Handle main.dart updates
             if 'update_main_dart' in task_plan:
@@ -333,6 +443,10 @@ def generate_task_summary(client: ollama.Client, user_input: str) -> str:
         return "Unable to generate summary."
 
 def main():
+    parser = argparse.ArgumentParser(description="Flutter LLM Assistant")
+    parser.add_argument('--no-cache', action='store_true', help="Regenerate code instead of reusing LLM responses cached on disk")
+    args = parser.parse_args()
+
     print("Welcome to the Flutter LLM Assistant!")
     print("This script will help you develop your Flutter app using AI-generated code.")
 
@@ -344,7 +458,7 @@ def main():
 
     # Create AIClient
     print("Initializing AI client...")
-    client = AIClient()
+    client = get_ai_client()
     print("AI client initialized.")
 
 
@@ -394,7 +508,7 @@ def main():
     else:
         print("Flutter app process started. Continuing with development.")
 
-    development_loop(client, project_root, flutter_process, selected_device)
+    development_loop(client, project_root, flutter_process, selected_device, use_disk_cache=not args.no_cache)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
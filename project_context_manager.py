@@ -1,41 +1,83 @@
 import os
-from typing import Dict, List
-from utils import strip_const_declarations
+import logging
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List
+from utils import walk_dart_files, write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+class FileContents(MutableMapping):
+    """
+    Mapping of relative file path to file text that keeps the raw UTF-8 bytes
+    and only decodes a file when its text is actually requested.
+    """
+    def __init__(self):
+        self._raw: Dict[str, bytes] = {}
+
+    def __getitem__(self, file_path: str) -> str:
+        return self._raw[file_path].decode('utf-8', 'replace')
+
+    def __setitem__(self, file_path: str, content: str):
+        self._raw[file_path] = content.encode('utf-8')
+
+    def __delitem__(self, file_path: str):
+        del self._raw[file_path]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._raw)
+
+    def __len__(self) -> int:
+        return len(self._raw)
+
+    def clear(self):
+        self._raw.clear()
+
+    def set_raw(self, file_path: str, data: bytes):
+        self._raw[file_path] = data
+
+    def raw(self, file_path: str) -> bytes:
+        return self._raw[file_path]
+
+    def head(self, file_path: str, chars: int) -> str:
+        # A UTF-8 character is at most 4 bytes; a character cut at the boundary is dropped
+        return self._raw[file_path][:chars * 4].decode('utf-8', 'ignore')[:chars]
 
 class ProjectContextManager:
     def __init__(self, project_root: str):
         self.project_root = project_root
-        self.file_contents: Dict[str, str] = {}
+        self._root_path = os.path.abspath(project_root)
+        self.file_contents = FileContents()
         self.project_structure: List[str] = []
         self.update_context()
 
     def update_context(self):
         self.file_contents.clear()
         self.project_structure.clear()
-        for root, dirs, files in os.walk(self.project_root):
-            for file in files:
-                if file.endswith('.dart'):
-                    file_path = os.path.join(root, file)
-                    relative_path = os.path.relpath(file_path, self.project_root)
-                    self.project_structure.append(relative_path)
-                    with open(file_path, 'r') as f:
-                        self.file_contents[relative_path] = f.read()
+        for file_path in walk_dart_files(self.project_root):
+            relative_path = os.path.relpath(file_path, self.project_root)
+            self.project_structure.append(relative_path)
+            with open(file_path, 'rb') as f:
+                self.file_contents.set_raw(relative_path, f.read())
 
     def get_context_prompt(self) -> str:
-        context = "Project Structure:\n"
-        context += "\n".join(self.project_structure)
-        context += "\n\nFile Contents:\n"
-        for file_path, content in self.file_contents.items():
-            context += f"\n--- {file_path} ---\n{content}\n"
-        return context
+        # Join the raw bytes and decode once for the whole prompt
+        parts = [b"Project Structure:\n", "\n".join(self.project_structure).encode('utf-8'), b"\n\nFile Contents:\n"]
+        for file_path in self.file_contents:
+            parts.append(b"\n--- " + file_path.encode('utf-8') + b" ---\n" + self.file_contents.raw(file_path) + b"\n")
+        return b"".join(parts).decode('utf-8', 'replace')
+
+    def _full_path(self, file_path: str) -> str:
+        return os.path.join(self._root_path, file_path)
 
     def update_file(self, file_path: str, content: str):
-        full_path = os.path.join(self.project_root, file_path)
+        full_path = self._full_path(file_path)
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
-        clean_content = strip_const_declarations(content)
-        with open(full_path, 'w') as f:
-            f.write(content)
-        self.update_context()
+        write_file_atomic(full_path, content)
+        # Keep the in-memory view in sync instead of rescanning the whole tree
+        if file_path.endswith('.dart'):
+            if file_path not in self.file_contents:
+                self.project_structure.append(file_path)
+            self.file_contents[file_path] = content
 
 
     def delete_file(self, file_path: str):
@@ -43,7 +85,7 @@ class ProjectContextManager:
         Delete a file from the project and update the context.
         """
         try:
-            full_path = os.path.join(self.project_root, file_path)
+            full_path = self._full_path(file_path)
             if os.path.exists(full_path):
                 os.remove(full_path)
                 if file_path in self.file_contents:
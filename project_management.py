@@ -1,6 +1,6 @@
 import os
 from typing import Dict
-from utils import run_command
+from utils import run_command, walk_dart_files
 
 def get_project_structure(root_dir: str) -> Dict[str, str]:
     """
@@ -9,12 +9,9 @@ def get_project_structure(root_dir: str) -> Dict[str, str]:
     print(f"Getting project structure for: {root_dir}")
     project_files = {}
     lib_dir = os.path.join(root_dir, 'lib')
-    for root, dirs, files in os.walk(lib_dir):
-        for file in files:
-            if file.endswith('.dart'):
-                file_path = os.path.join(root, file)
-                with open(file_path, 'r') as f:
-                    project_files[file_path] = f.read()
+    for file_path in walk_dart_files(lib_dir):
+        with open(file_path, 'r') as f:
+            project_files[file_path] = f.read()
     print(f"Found {len(project_files)} Dart files in the project.")
     return project_files
 
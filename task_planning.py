@@ -1,28 +1,63 @@
-import json
+import asyncio
+import atexit
+import functools
+import io
 import os
+import pathlib
 import re
 import logging
-from typing import List, Dict, Any, Tuple
+import json5
+import orjson
+from ruamel.yaml import YAML
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 from ai_client import AIClient
+from flutter_project_validator import FlutterProjectValidator
+from llm_cache import LLM_DISK_CACHE_DIR, LLMCache
+from utils import apply_unified_diff, find_json_span, looks_like_unified_diff, merge_appendable_change, strip_code_fences, to_json, write_file_atomic
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class TaskPlanner:
-    def __init__(self, client: AIClient):
-        self.client = client
-        self.max_retries = 3
-
-
-    def generate_task_plan(self, user_input: str, current_project_files: Dict[str, str]) -> Dict[str, Any]:
-        prompt = f"""
-        Generate a task plan for the following Flutter development task:
-
-        {user_input}
-
-        Current project files:
-        {json.dumps(list(current_project_files.keys()), indent=2)}
-
+MAX_CONCURRENT_REQUESTS = 4
+MAX_FILES_PER_BATCH = 6
+DETERMINISTIC_TEMPERATURE = 0
+# Output caps for single-file generation; a file response ends at its closing fence
+MIN_OUTPUT_TOKENS = 2048
+OUTPUT_TOKEN_HEADROOM = 1024
+FILE_OUTPUT_STOP_SEQUENCES = ['```\n\n']
+SUMMARY_PREVIEW_CHARS = 500
+MAX_SUMMARY_CHARS = 20000
+TASK_HISTORY_FILE = 'task_history.jsonl'
+# Provided by the Flutter SDK itself, never pinned in pubspec.yaml
+SDK_PACKAGES = frozenset({'flutter', 'dart'})
+# Set DEBUG_CONTENT to echo full file bodies to the console
+SHOW_GENERATED_CONTENT = bool(os.getenv('DEBUG_CONTENT'))
+
+CLASS_NAME_PATTERN = re.compile(r'class\s+(\w+)')
+# One scan picks up every field fallback_task_extraction needs
+FALLBACK_TASK_PATTERN = re.compile(
+    r'"main_task":\s*"(?P<main_task>[^"]*)"'
+    r'|"(?P<kind>subtasks|files|code_changes|dependencies)":\s*\[(?P<items>.*?)\]',
+    re.DOTALL
+)
+IMPORT_LINE_PATTERN = re.compile(r'^import\s+[\'"][^\'"]+[\'"][^;\n]*;[ \t]*$', re.MULTILINE)
+INITIAL_ROUTE_PATTERN = re.compile(r'initialRoute:\s*[\'"][^\'"]*[\'"]')
+ROUTES_BLOCK_PATTERN = re.compile(r'^([ \t]*)routes:\s*\{([^{}]*)\}', re.MULTILINE)
+PROVIDERS_LIST_PATTERN = re.compile(r'MultiProvider\(\s*providers:\s*\[')
+RETURN_MATERIAL_APP_PATTERN = re.compile(r'return\s+(?:const\s+)?MaterialApp\(')
+BARE_IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_]\w*$')
+ROUTE_WIDGET_PATTERN = re.compile(r'^(?:const\s+)?([A-Z]\w*)\s*\(')
+CHANGE_FILE_PATTERN = re.compile(r'"file":\s*"([^"]*)"')
+CHANGE_CONTENT_PATTERN = re.compile(r'"changes":\s*"([^"]*)"')
+WORD_PATTERN = re.compile(r'[a-z0-9]+')
+# Requests mentioning these change more than one file's contents, so they always go to the planner LLM
+STRUCTURAL_WORDS = frozenset({'delete', 'remove', 'rename', 'move', 'new', 'route', 'routes', 'navigate', 'navigation', 'package', 'dependency'})
+
+# Static instructions go out as the system prompt, ahead of the per-request data,
+# so the provider can reuse its cached prefix across calls.
+TASK_PLAN_SYSTEM = """
+        You are planning changes to a Flutter project.
 
         The main.dart file uses a template with:
         - MultiProvider wrapper for state management
@@ -47,27 +82,27 @@ class TaskPlanner:
         3. Required dependencies
 
         JSON structure:
-        {{
+        {
             "steps": [
-                {{
+                {
                     "type": "create_file" | "update_file" | "delete_file",
                     "file_path": "path/to/file",
                     "description": "Description of changes to the file. this should be interpreted from the prompt"
-                }}
+                }
             ],
-            "update_main_dart": {{
+            "update_main_dart": {
                 "imports_to_add": ["package:flutter/material.dart"],
-                "routes_to_add": {{"/route_name": "WidgetName()"}},
+                "routes_to_add": {"/route_name": "WidgetName()"},
                 "initial_route": "/route_name",  # If this is meant to be the home screen
                 "providers_to_initialize": ["ChangeNotifierProvider(create: (_) => SomeProvider())"]
-            }},
+            },
             "dependencies": [
-                {{
+                {
                     "package_name": "package_name",
                     "version": "^version_number"
-                }}
+                }
             ]
-        }}
+        }
 
         IMPORTANT:
         1. Your response must be a valid JSON object
@@ -76,215 +111,441 @@ class TaskPlanner:
         4. Follow the template structure for main.dart updates
         """
 
-    # Rest of your function remains the same...
-        for attempt in range(self.max_retries):
-            try:
-                response = self.client.generate(prompt=prompt)
-                logger.debug(f"Raw response: {response}")
+FOCUSED_SYSTEM = """
+        You create focused task plans for Flutter development tasks.
 
-                if isinstance(response, dict) and 'response' in response:
-                    task_plan = self.extract_json(response['response'])
-                elif isinstance(response, str):
-                    task_plan = self.extract_json(response)
-                else:
-                    raise ValueError(f"Unexpected response type: {type(response)}")
+        Consider the simplest possible implementation that fulfills the task requirements.
+        Only include files and changes that are absolutely necessary.
+        If the task can be accomplished by modifying existing files (e.g., main.dart), prefer that over creating new files.
+        Only include dependencies if they are absolutely necessary for the task.
 
-                if task_plan and self.validate_task_plan(task_plan):
-                    return task_plan
-                else:
-                    logger.warning(f"Generated invalid task plan on attempt {attempt + 1}. Retrying...")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON parsing error on attempt {attempt + 1}: {str(e)}")
-            except Exception as e:
-                logger.error(f"Error in generate_task_plan (attempt {attempt + 1}): {str(e)}")
+        Provide a JSON object with the following structure:
+        {
+            "files_to_create_or_update": [
+                {
+                    "path": "lib/main.dart",
+                    "description": "Detailed description of the changes to be made to this file with as much detail as possible based on the input prompt"
+                }
+            ],
+            "update_main_dart": {
+                "imports_to_add": [],
+                "routes_to_add": {},
+                "providers_to_add": []
+            },
+            "dependencies": []
+        }
 
-        raise ValueError("Failed to generate a valid task plan after maximum retries.")
+        Be specific about the changes to be made, mentioning exact widget names, text to be displayed, and layout modifications.
+        If a section is not needed, return an empty list or object for that section.
+        Ensure the response is a valid JSON object.
+        """
 
-    def extract_json(self, text: str) -> Dict[str, Any]:
-        # Try to find JSON-like structure in the text
-        try:
-            # First, try to parse the entire text as JSON
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # If that fails, try to find a JSON object within the text
-            match = re.search(r'\{.*\}', text, re.DOTALL)
-            if match:
-                try:
-                    return json.loads(match.group(0))
-                except json.JSONDecodeError:
-                    logger.error("Found JSON-like structure, but failed to parse it.")
-            else:
-                logger.error("No valid JSON structure found in the response.")
-        return {}
+PLANNING_SYSTEM = """
+        You create detailed task plans for Flutter development requests.
 
-    def validate_task_plan(self, task_plan: Dict[str, Any]) -> bool:
-        required_keys = ['steps', 'update_main_dart', 'dependencies']
-        if not all(key in task_plan for key in required_keys):
-            return False
-        if not isinstance(task_plan['steps'], list) or not task_plan['steps']:
-            return False
-        if not isinstance(task_plan['update_main_dart'], dict):
-            return False
-        if not isinstance(task_plan['dependencies'], list):
-            return False
-        return True
+        Provide a task plan as a JSON object with the following structure:
+        {
+            "files_to_create_or_update": [
+                {
+                    "path": "path/to/file.dart",
+                    "description": "Description of changes or new file content"
+                }
+            ],
+            "update_main_dart": {
+                "imports_to_add": ["package:flutter/material.dart", "package:your_app/path/to/file.dart"],
+                "routes_to_add": {"/route_name": "WidgetName()"},
+                "providers_to_add": ["ChangeNotifierProvider(create: (_) => SomeProvider())"]
+            },
+            "dependencies": ["package_name: ^version"]
+        }
 
+        Ensure your response is valid JSON and nothing else.
+        """
 
+CODEGEN_SYSTEM = """
+        As an expert Flutter developer, implement the requested task in the given file.
 
-    def generate_file_content(self, file_path: str, description: str, project_files: Dict[str, str]) -> str:
-        print(f"\n=== Generating Content for {file_path} ===")
-        print("Description:", description)
-        print("Existing content:")
-        print(project_files.get(file_path, "None"))
-        existing_content = project_files.get(file_path, "")
-        prompt = f"""
-        Generate valid Dart code for a Flutter app for the file {file_path}.
-        Description: {description}
+        Please provide the complete, updated Dart code for this Flutter file. If it's a new file, provide the full content. If it's an existing file, incorporate the necessary changes while preserving existing functionality.
 
-        Existing content:
-        ```dart
-        {existing_content}
-        ```
+        Follow these Flutter-specific guidelines:
+        1. Use Flutter widgets and material design principles where appropriate.
+        2. Implement proper state management techniques (e.g., StatefulWidget, Provider, Riverpod).
+        3. Follow Flutter best practices and conventions for code organization.
+        4. Use Flutter-specific libraries and plugins when necessary.
+        5. Implement error handling and input validation where appropriate.
+        6. Ensure the code is null-safe and uses modern Dart features.
+        7. Add comments to explain complex logic or widget structures.
+        8. Organize imports properly, putting Flutter imports first, then package imports, then relative imports.
 
-        Ensure to:
-        1. Include necessary imports (e.g., 'package:flutter/material.dart')
-        2. Extend appropriate classes (e.g., StatelessWidget)
-        3. Implement required methods (e.g., build)
-        4. Use proper Flutter widgets and syntax
+        Respond with only the Dart code for the Flutter file, nothing else. Do not include any explanations or comments outside the code.
+        Wrap the code with ```dart and ``` markers.
+        """
 
-        Provide only the Dart code for the file, without any markdown code block syntax.
+SPECIFIC_CODE_SYSTEM = """
+        You update files in a Flutter project to carry out a development task.
+
+        You are given the task, its subtasks, the changes to make, and one file with its existing content.
+        Please provide the complete, updated content for this file. If it's a new file, provide the full content. If it's an existing file, incorporate the necessary changes while preserving existing functionality.
+
+        Respond with only the file content, nothing else.
         """
 
-        for attempt in range(self.max_retries):
-            try:
-                response = self.client.generate(prompt=prompt)
-                if isinstance(response, dict) and 'response' in response:
-                    return self.remove_code_markers(response['response'])
-                elif isinstance(response, str):
-                    return self.remove_code_markers(response)
-                else:
-                    logger.error(f"Unexpected response format: {response}")
-            except Exception as e:
-                logger.error(f"Error generating content for {file_path} (attempt {attempt + 1}): {str(e)}")
+CODE_CHANGE_SYSTEM = """
+        You integrate proposed code changes into Dart files of a Flutter project.
 
-        logger.error(f"Failed to generate content for {file_path} after {self.max_retries} attempts.")
-        print(f"\nGenerated content for {file_path}:")
-        print(existing_content)
-        print("=== End File Generation ===\n")
+        You are given the current file content followed by a proposed code change.
+        Please integrate the proposed code change into the current file content.
+        Ensure that the changes are applied correctly and the resulting code is valid Dart/Flutter code.
+        Return the entire updated file content.
+        """
 
-        return existing_content
+BATCH_CODEGEN_SYSTEM = """
+        As an expert Flutter developer, implement the requested task across the given files.
 
-    def update_main_dart(self, main_dart_content: str, updates: Dict[str, Any]) -> str:
-        print("\n=== main.dart Update Process ===")
+        Provide the complete, updated Dart code for every listed file. For a new file, provide the full content. For an existing file, incorporate the necessary changes while preserving existing functionality.
 
-        # Extract route info for dynamic validation
-        route_widgets = {route: widget.replace('()', '')
-                        for route, widget in updates.get('routes_to_add', {}).items()}
+        Follow these Flutter-specific guidelines:
+        1. Use Flutter widgets and material design principles where appropriate.
+        2. Implement proper state management techniques (e.g., StatefulWidget, Provider, Riverpod).
+        3. Follow Flutter best practices and conventions for code organization.
+        4. Ensure the code is null-safe and uses modern Dart features.
+        5. Keep imports between the listed files consistent with their paths.
 
-        prompt = f"""
-        Update main.dart with routing and imports.
-        Current content:
-        ```dart
-        {main_dart_content}
-        ```
+        Respond with only a JSON object mapping each file path to its complete Dart code, for example:
+        {"lib/screens/home_screen.dart": "import 'package:flutter/material.dart';\\n..."}
+        Do not include markdown markers or any text outside the JSON object.
+        """
 
-        Required updates:
-        {json.dumps(updates, indent=2)}
+@functools.lru_cache(maxsize=32)
+def _file_list_json(file_paths: Tuple[str, ...]) -> str:
+    return to_json(list(file_paths), indent=True)
+
+# Stubs for new files in well-known folders, used when a task gives nothing more to go on
+SCAFFOLD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'scaffolds')
+SCAFFOLD_KINDS = {'lib/models/': 'model.dart', 'lib/widgets/': 'widget.dart', 'lib/providers/': 'provider.dart'}
+SCAFFOLD_CLASS_TOKEN = '__CLASS_NAME__'
+
+@functools.lru_cache(maxsize=None)
+def _scaffold_template(name: str) -> str:
+    with open(os.path.join(SCAFFOLD_DIR, name), 'r') as f:
+        return f.read()
+
+def scaffold_for(file_path: str) -> Optional[str]:
+    """Return a stub for a new file under lib/models, lib/widgets or lib/providers, or None for other paths."""
+    folder, _, file_name = file_path.replace('\\', '/').rpartition('/')
+    template = SCAFFOLD_KINDS.get(folder + '/')
+    if not template or not file_name.endswith('.dart'):
+        return None
+    class_name = ''.join(part.capitalize() for part in file_name[:-len('.dart')].split('_'))
+    return _scaffold_template(template).replace(SCAFFOLD_CLASS_TOKEN, class_name)
+
+def task_has_instructions(task: Dict[str, Any]) -> bool:
+    """True when the task says what to do: changes, a main task or any subtasks."""
+    return any(str(task.get(field) or '').strip() for field in ('changes', 'main_task')) or bool(task.get('subtasks'))
+
+def output_token_budget(existing_content: str) -> int:
+    # Roughly 3 characters per token for the file coming back, plus room for what the task adds
+    return max(MIN_OUTPUT_TOKENS, len(existing_content) // 3 + OUTPUT_TOKEN_HEADROOM)
+
+def file_list_json(project_files: Dict[str, str]) -> str:
+    """
+    JSON listing of the project's file paths for prompts, memoized on the set of paths
+    so retries and repeated prompt builds in a session reuse the same string.
+    """
+    return _file_list_json(tuple(sorted(project_files)))
 
-        STRICT REQUIREMENTS:
-        1. Keep existing main.dart structure but:
-           - Add necessary imports from /screens or /widgets for each route
-           - Update routes map with new routes
-           - Update initialRoute if specified
+class TaskPlanner:
+    def __init__(self, client: AIClient, use_disk_cache: bool = True, flutter_validator: Optional[FlutterProjectValidator] = None):
+        self.client = client
+        self.flutter_validator = flutter_validator
+        self.max_retries = 3
+        self.cache = LLMCache()
+        # File generation and code changes replay the same prompts when a task is re-run.
+        # Those calls run at temperature 0, so a stored answer is the one the model would give again.
+        disk_dir = LLM_DISK_CACHE_DIR if use_disk_cache else None
+        self.file_cache = LLMCache(disk_dir=disk_dir, namespace=client.model_name())
+        # Merging a code change is mechanical, so it can go to the smaller model
+        self.light_cache = LLMCache(disk_dir=disk_dir, namespace=client.model_name(light=True))
+        self._roots: Dict[str, pathlib.Path] = {}
+        # Directories already known to exist this session, so repeat tasks skip the filesystem check
+        self._known_dirs: Set[str] = set()
+        atexit.register(self._log_cache_stats)
+
+    def _log_cache_stats(self):
+        for name, cache in (("planning", self.cache), ("file", self.file_cache), ("code change", self.light_cache)):
+            if cache.hits or cache.misses:
+                logger.info("LLM %s cache: %s", name, cache.stats())
+
+    def _root(self, project_root: str) -> pathlib.Path:
+        root = self._roots.get(project_root)
+        if root is None:
+            root = self._roots[project_root] = pathlib.Path(project_root)
+        return root
+
+    def _ensure_dir(self, directory: str) -> bool:
+        """Create directory if needed. Returns True when it didn't exist before."""
+        if directory in self._known_dirs:
+            return False
+        # Let mkdir report an existing directory instead of stat-ing it first
+        try:
+            os.makedirs(directory)
+            created = True
+        except FileExistsError:
+            created = False
+        self._known_dirs.add(directory)
+        return created
 
-        2. NEVER include ANY widget implementations except MyApp class
+    def _generate(self, prompt: str, system: Optional[str] = None):
+        return self.cache.get_or_generate(prompt, self.client.generate, system=system)
 
-        3. For each new route:
-           - Add import statement for the widget
-           - Only reference widget in routes (no implementation)
-           - Example: '/profile': (context) => ProfileScreen()
+    def _generate_persistent(self, prompt: str, system: Optional[str] = None):
+        options = {'temperature': DETERMINISTIC_TEMPERATURE}
+        return self.file_cache.get_or_generate(prompt, self.client.generate, system=system, options=options)
 
-        4. Structure should ALWAYS be:
-           - Imports at top
-           - main() function
-           - MyApp class
-           - NO other class implementations
+    def _generate_light(self, prompt: str, system: Optional[str] = None):
+        options = {'temperature': DETERMINISTIC_TEMPERATURE, 'light': True}
+        return self.light_cache.get_or_generate(prompt, self.client.generate, system=system, options=options)
 
-        DELETE any widget implementations found in main.dart (except MyApp).
-        If a widget is used in routes, it MUST be imported, not implemented here.
+    async def _agenerate_persistent(self, prompt: str, system: Optional[str] = None, **options):
+        options = {'temperature': DETERMINISTIC_TEMPERATURE, **options}
+        return await self.file_cache.aget_or_generate(prompt, self.client.agenerate, system=system, options=options)
 
-        Return ONLY the updated main.dart content.
-        """
+    def generate_task_plan(self, user_input: str, current_project_files: Dict[str, str]) -> Dict[str, Any]:
+        return asyncio.run(self.generate_task_plan_async(user_input, current_project_files))
 
-        for attempt in range(self.max_retries):
-            try:
-                print(f"\nAttempt {attempt + 1} to update main.dart")
-                response = self.client.generate(prompt=prompt)
-                updated_content = self.remove_code_markers(response['response'])
-
-                # Verify content has proper structure
-                if self._verify_dynamic_main_dart(updated_content, route_widgets):
-                    print("\nSuccessfully updated main.dart with proper structure")
-                    return updated_content
-                else:
-                    print(f"Invalid main.dart structure (attempt {attempt + 1})")
+    async def generate_task_plan_async(self, user_input: str, current_project_files: Dict[str, str]) -> Dict[str, Any]:
+        if self.determine_task_complexity(user_input) == 'simple':
+            task_plan = self._template_simple_plan(user_input, current_project_files)
+            if task_plan:
+                logger.info("Planned simple request for %s without an LLM call", task_plan['steps'][0]['file_path'])
+                return task_plan
 
-            except Exception as e:
-                print(f"Error in main.dart update (attempt {attempt + 1}): {str(e)}")
+        prompt = f"""
+        Generate a task plan for the following Flutter development task:
 
-        print("Failed to generate valid main.dart, returning original")
-        return main_dart_content
+        {user_input}
 
-    def _verify_dynamic_main_dart(self, content: str, route_widgets: Dict[str, str]) -> bool:
+        Current project files:
+        {file_list_json(current_project_files)}
+        """
+
+        def parse(response: Any) -> Optional[Dict[str, Any]]:
+            if isinstance(response, dict) and 'response' in response:
+                task_plan = self.extract_json(response['response'])
+            elif isinstance(response, str):
+                task_plan = self.extract_json(response)
+            else:
+                raise ValueError(f"Unexpected response type: {type(response)}")
+            return task_plan if task_plan and self.validate_task_plan(task_plan) else None
+
+        task_plan = await self._generate_validated(prompt, TASK_PLAN_SYSTEM, parse)
+        if task_plan is None:
+            raise ValueError("Failed to generate a valid task plan after maximum retries.")
+        return task_plan
+
+    async def _generate_validated(self, prompt: str, system: str, parse: Callable[[Any], Optional[Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
         """
-        Dynamically verify main.dart structure based on required routes/widgets.
+        Retry loop for prompts whose answer is validated after the fact. Attempts run one at a
+        time, and an answer that fails to parse or validate is dropped from the cache before the retry.
         """
-        # Should only have MyApp class
-        class_definitions = re.findall(r'class\s+(\w+)', content)
-        if len(class_definitions) > 1 or class_definitions[0] != 'MyApp':
-            print(f"Found invalid classes: {class_definitions}")
-            return False
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                response = await self.cache.aget_or_generate(prompt, self.client.agenerate, system=system)
+                logger.debug("Raw response: %r", response)
+                result = parse(response)
+                if result:
+                    return result
+                logger.warning(f"Generated invalid task plan on attempt {attempt}. Retrying...")
+            except orjson.JSONDecodeError as e:
+                logger.error(f"JSON parsing error on attempt {attempt}: {str(e)}")
+            except Exception as e:
+                logger.error(f"Error generating plan (attempt {attempt}): {str(e)}")
+            self.cache.invalidate(prompt, system)
 
-        # Check for necessary imports for each widget
-        for widget_name in route_widgets.values():
-            import_patterns = [
-                f"import '.*/{widget_name.lower()}.dart'",
-                f"import '.*screens/{widget_name.lower()}.dart'",
-                f"import '.*widgets/{widget_name.lower()}.dart'"
-            ]
-            if not any(re.search(pattern, content) for pattern in import_patterns):
-                print(f"Missing import for {widget_name}")
-                return False
-
-        # Verify route structure
-        routes_section = re.search(r'routes:\s*{([^}]*)}', content)
-        if not routes_section:
-            print("Missing routes section")
-            return False
+        return None
 
-        # Check each route has proper format
-        for route, widget in route_widgets.items():
-            route_pattern = f"'{route}':\s*\(context\)\s*=>\s*{widget}\(\)"
-            if not re.search(route_pattern, content):
-                print(f"Invalid route format for {route}")
-                return False
+    def extract_json(self, text: str) -> Dict[str, Any]:
+        # Try to find JSON-like structure in the text
+        try:
+            # First, try to parse the entire text as JSON
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # If that fails, try to find a JSON object within the text
+            span = find_json_span(text)
+            if span:
+                try:
+                    return orjson.loads(text[span[0]:span[1]])
+                except orjson.JSONDecodeError:
+                    logger.error("Found JSON-like structure, but failed to parse it.")
+            else:
+                logger.error("No valid JSON structure found in the response.")
+        return {}
 
+    def validate_task_plan(self, task_plan: Dict[str, Any]) -> bool:
+        required_keys = ['steps', 'update_main_dart', 'dependencies']
+        if not all(key in task_plan for key in required_keys):
+            return False
+        if not isinstance(task_plan['steps'], list) or not task_plan['steps']:
+            return False
+        if not isinstance(task_plan['update_main_dart'], dict):
+            return False
+        if not isinstance(task_plan['dependencies'], list):
+            return False
         return True
 
     def _validate_main_content(self, content: str) -> bool:
         """Check if main.dart content follows our rules"""
         # Count class definitions - should only find MyApp
-        class_matches = re.findall(r'class\s+(\w+)', content)
+        class_matches = CLASS_NAME_PATTERN.findall(content)
         if len(class_matches) > 1 or (len(class_matches) == 1 and class_matches[0] != 'MyApp'):
             return False
 
         return True
 
+    def _apply_main_dart_updates(self, content: str, updates: Dict[str, Any]) -> str:
+        """
+        Apply imports, routes, initial route and providers from a task plan to main.dart
+        with plain string edits. Raises ValueError when the file doesn't match the template.
+        """
+        if not content.strip():
+            raise ValueError("main.dart is empty")
+
+        providers = updates.get('providers_to_initialize') or updates.get('providers_to_add') or []
+        imports = list(updates.get('imports_to_add', []))
+        if providers:
+            imports.append('package:provider/provider.dart')
+
+        # 1. Imports go after the last existing import
+        new_imports = []
+        for imp in imports:
+            line = imp.strip() if imp.strip().startswith('import ') else f"import '{imp.strip()}';"
+            if not line.endswith(';'):
+                line += ';'
+            if line not in content and line not in new_imports:
+                new_imports.append(line)
+        if new_imports:
+            last_import = None
+            for last_import in IMPORT_LINE_PATTERN.finditer(content):
+                pass
+            if last_import:
+                insert_at = last_import.end()
+                content = content[:insert_at] + "\n" + "\n".join(new_imports) + content[insert_at:]
+            else:
+                content = "\n".join(new_imports) + "\n\n" + content
+
+        # 2. Routes go at the end of the routes map
+        routes = updates.get('routes_to_add', {})
+        if routes:
+            routes_block = ROUTES_BLOCK_PATTERN.search(content)
+            if not routes_block:
+                raise ValueError("no routes map found")
+            if '/' in routes and 'home:' in content:
+                raise ValueError("route '/' conflicts with home")
+            indent = routes_block.group(1) + "  "
+            body = routes_block.group(2).rstrip()
+            entries = [f"{indent}'{route}': (context) => {self._route_widget(content, widget)},"
+                       for route, widget in routes.items()
+                       if f"'{route}'" not in body and f'"{route}"' not in body]
+            if entries:
+                if body.strip() and not body.endswith((',', '{')) and not body.splitlines()[-1].strip().startswith('//'):
+                    body += ','
+                new_block = f"{routes_block.group(1)}routes: {{{body}\n" + "\n".join(entries) + f"\n{routes_block.group(1)}}}"
+                content = content[:routes_block.start()] + new_block + content[routes_block.end():]
+
+        # 3. Initial route. An existing home: stays as the '/' route underneath it, so back
+        # navigation from the initial route still lands on the home screen
+        initial_route = updates.get('initial_route')
+        if initial_route:
+            if INITIAL_ROUTE_PATTERN.search(content):
+                content = INITIAL_ROUTE_PATTERN.sub(f"initialRoute: '{initial_route}'", content, count=1)
+            else:
+                routes_block = ROUTES_BLOCK_PATTERN.search(content)
+                if not routes_block:
+                    raise ValueError("no routes map to anchor initialRoute")
+                content = (content[:routes_block.start()] + f"{routes_block.group(1)}initialRoute: '{initial_route}',\n"
+                           + content[routes_block.start():])
+
+        # 4. Providers go into an existing MultiProvider, or MaterialApp gets wrapped in one
+        if providers:
+            providers_list = PROVIDERS_LIST_PATTERN.search(content)
+            new_providers = [p.rstrip(',') for p in providers if p.rstrip(',') not in content]
+            if providers_list and new_providers:
+                insert_at = providers_list.end()
+                indent = self._line_indent(content, providers_list.start()) + "    "
+                content = content[:insert_at] + "".join(f"\n{indent}{p}," for p in new_providers) + content[insert_at:]
+            elif new_providers:
+                material_app = RETURN_MATERIAL_APP_PATTERN.search(content)
+                if not material_app:
+                    raise ValueError("no MaterialApp to wrap with providers")
+                app_start = material_app.start() + len('return ')
+                app_end = self._find_closing_paren(content, material_app.end() - 1)
+                indent = self._line_indent(content, material_app.start())
+                # MaterialApp moves one level deeper as the child, so its body and closing paren shift too
+                material_app_text = content[app_start:app_end + 1].replace("\n", "\n  ").replace("\n  \n", "\n\n")
+                provider_lines = "".join(f"{indent}    {p},\n" for p in new_providers)
+                content = (content[:app_start] + f"MultiProvider(\n{indent}  providers: [\n" + provider_lines
+                           + f"{indent}  ],\n{indent}  child: " + material_app_text + f",\n{indent})"
+                           + content[app_end + 1:])
+
+        return content
+
+    @staticmethod
+    def _route_widget(content: str, widget: str) -> str:
+        """
+        Dart expression for a route's builder. A bare class name gets its constructor call,
+        and the class has to be declared or imported in main.dart, else ValueError.
+        """
+        widget = widget.strip().rstrip(',')
+        if BARE_IDENTIFIER_PATTERN.match(widget):
+            widget += '()'
+        widget_class = ROUTE_WIDGET_PATTERN.match(widget)
+        if not widget_class:
+            raise ValueError(f"unsupported route widget: {widget}")
+        class_name = widget_class.group(1)
+        file_name = re.sub(r'(?<!^)(?=[A-Z])', '_', class_name).lower() + '.dart'
+        imported = any(re.search(rf'[\'"/]{re.escape(file_name)}[\'"]', match.group(0))
+                       for match in IMPORT_LINE_PATTERN.finditer(content))
+        if not imported and not re.search(rf'\bclass\s+{class_name}\b', content):
+            raise ValueError(f"no import for route widget {class_name}")
+        return widget
+
+    @staticmethod
+    def _line_indent(content: str, index: int) -> str:
+        line_start = content.rfind('\n', 0, index) + 1
+        line = content[line_start:index]
+        return line[:len(line) - len(line.lstrip())]
+
+    @staticmethod
+    def _find_closing_paren(content: str, open_index: int) -> int:
+        depth = 0
+        quote = None
+        in_comment = False
+        for index in range(open_index, len(content)):
+            char = content[index]
+            if in_comment:
+                in_comment = char != '\n'
+            elif quote:
+                if char == quote and content[index - 1] != '\\':
+                    quote = None
+            elif content.startswith('//', index):
+                in_comment = True
+            elif char in ('"', "'"):
+                quote = char
+            elif char == '(':
+                depth += 1
+            elif char == ')':
+                depth -= 1
+                if depth == 0:
+                    return index
+        raise ValueError("unbalanced parentheses in main.dart")
+
+    @staticmethod
+    def _is_balanced(content: str) -> bool:
+        return all(content.count(open_char) == content.count(close_char)
+                   for open_char, close_char in (('(', ')'), ('{', '}'), ('[', ']')))
+
     def remove_code_markers(self, content: str) -> str:
-        # Remove any potential markdown code block markers
-        content = re.sub(r'```dart\s*', '', content)
-        content = re.sub(r'\s*```', '', content)
-        return content.strip()
+        return strip_code_fences(content)
 
     def determine_task_complexity(self, user_input: str) -> str:
         # Simple heuristic for task complexity
@@ -292,39 +553,58 @@ class TaskPlanner:
             return 'simple'
         return 'complex'
 
+    def _template_simple_plan(self, user_input: str, current_project_files: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """
+        Single-step plan for a short edit that names exactly one existing file, e.g.
+        "make the home screen title red" -> lib/screens/home_screen.dart. Returns None
+        when the request doesn't point at one file, so the LLM plans it instead.
+        """
+        words = set(WORD_PATTERN.findall(user_input.lower()))
+        if words & STRUCTURAL_WORDS:
+            return None
+        matches = []
+        for file_path in current_project_files:
+            file_name = os.path.basename(file_path)
+            if not file_name.endswith('.dart') or file_name == 'main.dart':
+                continue
+            if set(file_name[:-len('.dart')].split('_')) <= words:
+                matches.append(file_path)
+        if len(matches) != 1:
+            return None
+        return {
+            "steps": [{"type": "update_file", "file_path": matches[0], "description": user_input}],
+            "update_main_dart": {"imports_to_add": [], "routes_to_add": {}, "initial_route": "", "providers_to_initialize": []},
+            "dependencies": []
+        }
+
     def robust_json_correction(self, invalid_json: str) -> Dict[str, Any]:
         # Remove any non-JSON content before and after the main JSON structure
-        json_match = re.search(r'\{.*\}', invalid_json, re.DOTALL)
-        if json_match:
-            potential_json = json_match.group(0)
+        span = find_json_span(invalid_json)
+        if span:
+            potential_json = invalid_json[span[0]:span[1]]
         else:
             logger.error(f"No JSON-like structure found in: {invalid_json}")
             return {}
 
-        # Handle escaped quotes within JSON strings
-        potential_json = re.sub(r'(?<!\\)"([^"]*)"', lambda m: '"{}"'.format(m.group(1).replace('"', '\\"')), potential_json)
-
-        # Fix common JSON errors
-        potential_json = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', potential_json)  # Add quotes to keys
-        potential_json = re.sub(r',\s*([}\]])', r'\1', potential_json)  # Remove trailing commas
-        potential_json = potential_json.replace("'", '"')  # Replace single quotes with double quotes
-
-        # Handle unescaped quotes in values
-        potential_json = re.sub(r':\s*"([^"]*)"([^,}\]]*)"', r':"\1\2"', potential_json)
+        try:
+            return orjson.loads(potential_json)
+        except orjson.JSONDecodeError:
+            pass
 
+        # json5 accepts single quotes, unquoted keys and trailing commas in one pass
         try:
-            return json.loads(potential_json)
-        except json.JSONDecodeError as e:
+            return json5.loads(potential_json)
+        except ValueError as e:
             logger.error(f"JSON correction failed: {str(e)}")
             logger.error(f"Problematic JSON: {potential_json}")
             return {}
 
     def parse_and_validate_tasks(self, response: str) -> Dict[str, Any]:
         try:
-            tasks = json.loads(response)
+            tasks = orjson.loads(response)
             if isinstance(tasks, dict) and all(key in tasks for key in ['files_to_create_or_update', 'update_main_dart', 'dependencies']):
                 return tasks
-        except json.JSONDecodeError:
+        except orjson.JSONDecodeError:
             pass
 
         logger.error(f"Invalid task plan format:\n{response}")
@@ -333,17 +613,18 @@ class TaskPlanner:
     def fallback_task_extraction(self, response: str) -> List[Dict[str, Any]]:
         logger.info("Attempting fallback task extraction")
         tasks = []
-        task_pattern = r'"main_task":\s*"([^"]*)"'
-        subtasks_pattern = r'"subtasks":\s*\[(.*?)\]'
-        files_pattern = r'"files":\s*\[(.*?)\]'
-        code_changes_pattern = r'"code_changes":\s*\[(.*?)\]'
-        dependencies_pattern = r'"dependencies":\s*\[(.*?)\]'
-
-        main_tasks = re.findall(task_pattern, response)
-        subtasks_lists = re.findall(subtasks_pattern, response, re.DOTALL)
-        files_lists = re.findall(files_pattern, response, re.DOTALL)
-        code_changes_lists = re.findall(code_changes_pattern, response, re.DOTALL)
-        dependencies_lists = re.findall(dependencies_pattern, response, re.DOTALL)
+        fields = {"main_task": [], "subtasks": [], "files": [], "code_changes": [], "dependencies": []}
+        for match in FALLBACK_TASK_PATTERN.finditer(response):
+            if match.group('kind'):
+                fields[match.group('kind')].append(match.group('items'))
+            else:
+                fields["main_task"].append(match.group('main_task'))
+
+        main_tasks = fields["main_task"]
+        subtasks_lists = fields["subtasks"]
+        files_lists = fields["files"]
+        code_changes_lists = fields["code_changes"]
+        dependencies_lists = fields["dependencies"]
 
         for i, main_task in enumerate(main_tasks):
             task = {
@@ -353,32 +634,47 @@ class TaskPlanner:
                 "code_changes": self.extract_code_changes(code_changes_lists[i] if i < len(code_changes_lists) else ""),
                 "dependencies": self.extract_list_items(dependencies_lists[i] if i < len(dependencies_lists) else "")
             }
-            tasks.append(task)
+            tasks.append(self._normalize_task(task))
 
         return tasks
 
+    def _normalize_task(self, task: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Give a task one shape for its list fields: every dependency becomes
+        {'package', 'version'} and every code change {'file', 'changes'}.
+        """
+        dependencies = []
+        for dep in task.get('dependencies', []):
+            if isinstance(dep, dict):
+                dependencies.append({'package': dep.get('package') or dep.get('package_name', ''), 'version': dep.get('version', '*')})
+            else:
+                # Plain entries look like "provider" or "provider: ^6.0.0"
+                package, _, version = str(dep).partition(':')
+                dependencies.append({'package': package.strip(), 'version': version.strip() or '*'})
+        code_changes = [
+            change if isinstance(change, dict) and 'file' in change and 'changes' in change
+            else {'file': '', 'changes': str(change)}
+            for change in task.get('code_changes', [])
+        ]
+        return {**task, 'dependencies': dependencies, 'code_changes': code_changes}
+
     def extract_list_items(self, list_str: str) -> List[str]:
         return [item.strip().strip('"') for item in list_str.split(',') if item.strip()]
 
     def extract_code_changes(self, code_changes_str: str) -> List[Dict[str, str]]:
         changes = []
-        file_pattern = r'"file":\s*"([^"]*)"'
-        changes_pattern = r'"changes":\s*"([^"]*)"'
 
-        files = re.findall(file_pattern, code_changes_str)
-        changes_list = re.findall(changes_pattern, code_changes_str)
+        files = CHANGE_FILE_PATTERN.findall(code_changes_str)
+        changes_list = CHANGE_CONTENT_PATTERN.findall(code_changes_str)
 
         for i, file in enumerate(files):
             if i < len(changes_list):
                 changes.append({"file": file, "changes": changes_list[i]})
 
         return changes
-    def validate_and_connect_project(self, project_root: str, project_files: Dict[str, str], tasks: List[Dict[str, Any]]):
-        self.flutter_validator.validate_and_connect_files(project_root, project_files, tasks)
-
 
     def update_or_create_file(self, project_root: str, file_path: str, description: str, project_files: Dict[str, str]):
-        full_path = os.path.join(project_root, file_path)
+        full_path = self._root(project_root) / file_path
         existing_content = project_files.get(file_path, "")
 
         prompt = f"""
@@ -396,17 +692,17 @@ class TaskPlanner:
 
         for attempt in range(self.max_retries):
             try:
-                response = self.client.generate(prompt=prompt)
+                response = self._generate(prompt)
                 generated_content = self.flutter_validator.extract_code_from_response(response['response'])
 
                 if self.flutter_validator.validate_dart_code(generated_content):
                     project_files[file_path] = generated_content
-                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
-                    with open(full_path, 'w') as f:
-                        f.write(generated_content)
-                    logger.info(f"Successfully updated/created: {file_path}")
+                    self._ensure_dir(str(full_path.parent))
+                    write_file_atomic(str(full_path), generated_content)
+                    logger.info("Successfully updated/created: %s", file_path)
                     return
                 else:
+                    self.cache.invalidate(prompt)
                     logger.warning(f"Generated invalid code for {file_path} (attempt {attempt + 1}). Retrying...")
             except Exception as e:
                 logger.warning(f"Error generating code for {file_path} (attempt {attempt + 1}): {str(e)}")
@@ -414,72 +710,73 @@ class TaskPlanner:
         logger.error(f"Failed to generate valid code for {file_path} after {self.max_retries} attempts.")
 
     def summarize_file_contents(self, project_files: Dict[str, str]) -> str:
-        summary = ""
-        for file_path, content in project_files.items():
-            summary += f"\nFile: {file_path}\n"
-            summary += f"Content (first 500 characters):\n{content[:500]}...\n"
-        return summary
+        # FileContents can hand out a prefix without decoding the whole file
+        head = getattr(project_files, 'head', None)
+        parts = []
+        total = 0
+        for index, file_path in enumerate(project_files):
+            preview = head(file_path, SUMMARY_PREVIEW_CHARS) if head else project_files[file_path][:SUMMARY_PREVIEW_CHARS]
+            part = f"\nFile: {file_path}\nContent (first {SUMMARY_PREVIEW_CHARS} characters):\n{preview}...\n"
+            total += len(part)
+            if total > MAX_SUMMARY_CHARS:
+                parts.append(f"\n... {len(project_files) - index} more files not shown\n")
+                break
+            parts.append(part)
+        return "".join(parts)
 
     def save_task_history(self, task: Dict[str, Any], project_root: str):
-        history_file = os.path.join(project_root, 'task_history.json')
+        # JSON Lines: appending a task is a single write, however long the history grows
+        history_file = self._root(project_root) / TASK_HISTORY_FILE
+        with open(history_file, 'ab') as f:
+            f.write(orjson.dumps(task) + b'\n')
+        logger.info(f"Task saved to history: {task['main_task']}")
+
+    def load_task_history(self, project_root: str, max_tasks: Optional[int] = None) -> List[Dict[str, Any]]:
+        history_file = self._root(project_root) / TASK_HISTORY_FILE
         try:
-            with open(history_file, 'r+') as f:
-                history = json.load(f)
-                history.append(task)
-                f.seek(0)
-                json.dump(history, f, indent=2)
-                f.truncate()
-            logger.info(f"Task saved to history: {task['main_task']}")
-        except FileNotFoundError:
-            with open(history_file, 'w') as f:
-                json.dump([task], f, indent=2)
-            logger.info(f"Created new task history file with task: {task['main_task']}")
-        except json.JSONDecodeError:
-            logger.error("Error reading task history. Creating new history.")
-            with open(history_file, 'w') as f:
-                json.dump([task], f, indent=2)
-
-    def load_task_history(self, project_root: str) -> List[Dict[str, Any]]:
-        history_file = os.path.join(project_root, 'task_history.json')
-        try:
-            with open(history_file, 'r') as f:
-                return json.load(f)
+            with open(history_file, 'rb') as f:
+                # A bounded deque only keeps the most recent lines in memory
+                lines = deque(f, maxlen=max_tasks) if max_tasks else f
+                history = []
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        history.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        logger.error("Skipping unreadable entry in task history.")
+                return history
         except FileNotFoundError:
             logger.warning("Task history file not found. Returning empty history.")
             return []
-        except json.JSONDecodeError:
-            logger.error("Error decoding task history. Returning empty history.")
-            return []
 
     def summarize_task_history(self, tasks: List[Dict[str, Any]], max_tasks: int = 5) -> str:
         recent_tasks = tasks[-max_tasks:]
-        summary = "Previous tasks:\n"
+        parts = ["Previous tasks:\n"]
         for i, task in enumerate(recent_tasks, 1):
-            summary += f"{i}. {task['main_task']}\n"
+            parts.append(f"{i}. {task['main_task']}\n")
             for subtask in task.get('subtasks', [])[:3]:  # Limit to first 3 subtasks for brevity
-                summary += f"   - {subtask}\n"
-        return summary
+                parts.append(f"   - {subtask}\n")
+        return "".join(parts)
 
     def summarize_project_structure(self, project_files: Dict[str, str]) -> str:
-        summary = "Current project structure:\n"
-        for file_path in sorted(project_files.keys()):
-            summary += f"- {file_path}\n"
-        return summary
+        return "Current project structure:\n" + "".join(f"- {file_path}\n" for file_path in sorted(project_files))
 
     def generate_detailed_tasks(self, prompt: str, project_files: Dict[str, str], project_root: str) -> Dict[str, Any]:
         planning_prompt = self.create_planning_prompt(prompt, project_files)
 
         for attempt in range(self.max_retries):
             try:
-                logger.info(f"Sending request to LLM (attempt {attempt + 1})")
-                response = self.client.generate( prompt=planning_prompt)
-                logger.info(f"Received response from LLM (attempt {attempt + 1})")
-                logger.debug(f"Raw response from LLM (attempt {attempt + 1}):\n{response['response']}")
+                logger.info("Sending request to LLM (attempt %d)", attempt + 1)
+                response = self._generate(planning_prompt, system=PLANNING_SYSTEM)
+                logger.info("Received response from LLM (attempt %d)", attempt + 1)
+                logger.debug("Raw response from LLM (attempt %d):\n%s", attempt + 1, response['response'])
 
                 tasks = self.parse_and_validate_tasks(response['response'])
                 if tasks:
                     return tasks
                 else:
+                    self.cache.invalidate(planning_prompt, PLANNING_SYSTEM)
                     logger.warning(f"Generated invalid task plan on attempt {attempt + 1}. Retrying...")
 
             except Exception as e:
@@ -489,113 +786,131 @@ class TaskPlanner:
         return {}
 
     def generate_code(self, task: Dict[str, Any], project_files: Dict[str, str], project_root: str) -> Dict[str, str]:
+        return asyncio.run(self.generate_code_async(task, project_files, project_root))
+
+    async def generate_code_async(self, task: Dict[str, Any], project_files: Dict[str, str], project_root: str) -> Dict[str, str]:
         generated_updates = {}
         files = task.get('files', [])
-        changes = task.get('changes', '')
         print(f"\n--- Generating code for task: {task['main_task']} ---")
         if not files:
             logger.warning(f"No files specified for task: {task.get('main_task', 'Unknown task')}")
             return generated_updates
 
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        batched = await self._generate_batches(semaphore, task, files, project_files)
+
+        # Whatever the batches didn't cover goes out as one prompt per file, capped to stay within provider rate limits
+        remaining = [file_path for file_path in files if file_path not in batched]
+        results = await asyncio.gather(
+            *(self._generate_file_code(semaphore, task, file_path, project_files) for file_path in remaining),
+            return_exceptions=True
+        )
+        results_by_file = dict(zip(remaining, results))
+        results_by_file.update(batched)
+
         for file_path in files:
-            try:
-                full_path = os.path.join(project_root, file_path)
-                existing_content = project_files.get(file_path, "")
-
-                prompt = f"""
-                As an expert Flutter developer, implement the following task:
-
-                Task: {task.get('main_task', 'Unknown task')}
-                Subtasks: {json.dumps(task.get('subtasks', []))}
-                File: {file_path}
-
-                Existing content:
-                ```dart
-                {existing_content}
-                ```
-
-                Changes to make:
-                {changes}
-
-                Please provide the complete, updated Dart code for this Flutter file. If it's a new file, provide the full content. If it's an existing file, incorporate the necessary changes while preserving existing functionality.
-
-                Follow these Flutter-specific guidelines:
-                1. Use Flutter widgets and material design principles where appropriate.
-                2. Implement proper state management techniques (e.g., StatefulWidget, Provider, Riverpod).
-                3. Follow Flutter best practices and conventions for code organization.
-                4. Use Flutter-specific libraries and plugins when necessary.
-                5. Implement error handling and input validation where appropriate.
-                6. Ensure the code is null-safe and uses modern Dart features.
-                7. Add comments to explain complex logic or widget structures.
-                8. Organize imports properly, putting Flutter imports first, then package imports, then relative imports.
-
-                Respond with only the Dart code for the Flutter file, nothing else. Do not include any explanations or comments outside the code.
-                Wrap the code with ```dart and ``` markers.
-                """
-
-                response = self.client.generate( prompt=prompt)
-                updated_content = self.remove_code_markers(response['response'].strip())
-                generated_updates[file_path] = updated_content
-                logger.info(f"Generated content for file: {file_path}")
-                print(f"Generated content for file: {file_path}")
-                print(f"Content:\n{updated_content}\n")
-            except Exception as e:
-                logger.error(f"Error generating code for file {file_path}: {str(e)}")
-                print(f"Error generating code for file {file_path}: {str(e)}")
+            result = results_by_file[file_path]
+            if isinstance(result, Exception):
+                logger.error(f"Error generating code for file {file_path}: {str(result)}")
+                print(f"Error generating code for file {file_path}: {str(result)}")
+                continue
+            generated_updates[file_path] = result
+            logger.info("Generated content for file: %s", file_path)
+            print(f"Generated content for file: {file_path}")
+            if SHOW_GENERATED_CONTENT:
+                print(f"Content:\n{result}\n")
 
         print("--- Code generation complete ---\n")
         return generated_updates
 
+    async def _generate_batches(self, semaphore: asyncio.Semaphore, task: Dict[str, Any], files: List[str], project_files: Dict[str, str]) -> Dict[str, str]:
+        """Generate a multi-file task MAX_FILES_PER_BATCH files per request. Files missing from the result need a per-file call."""
+        batched = {}
+        if len(files) > 1:
+            # Files of one task share the same task context, so ask for several per request
+            batches = [files[i:i + MAX_FILES_PER_BATCH] for i in range(0, len(files), MAX_FILES_PER_BATCH)]
+            for batch_result in await asyncio.gather(
+                *(self._generate_batch_code(semaphore, task, batch, project_files) for batch in batches),
+                return_exceptions=True
+            ):
+                if isinstance(batch_result, Exception):
+                    logger.warning(f"Batched code generation failed, generating files one by one: {str(batch_result)}")
+                else:
+                    batched.update(batch_result)
+        return batched
 
+    async def _generate_batch_code(self, semaphore: asyncio.Semaphore, task: Dict[str, Any], batch: List[str], project_files: Dict[str, str]) -> Dict[str, str]:
+        file_blocks = "\n".join(
+            f'<file path="{file_path}">\n{project_files.get(file_path, "")}\n</file>' for file_path in batch
+        )
+        prompt = f"""
+        Implement the following task:
+
+        Task: {task.get('main_task', 'Unknown task')}
+        Subtasks: {to_json(task.get('subtasks', []))}
+        Files: {to_json(batch)}
+
+        Existing content:
+        {file_blocks}
+
+        Changes to make:
+        {task.get('changes', '')}
+        """
+
+        async with semaphore:
+            response = await self.cache.aget_or_generate(prompt, self.client.agenerate, system=BATCH_CODEGEN_SYSTEM)
+        contents = self.extract_json(response['response'])
+        generated = {file_path: self.remove_code_markers(contents[file_path])
+                     for file_path in batch if isinstance(contents.get(file_path), str) and contents[file_path].strip()}
+        if len(generated) < len(batch):
+            # Don't keep serving a partial answer; the missing files are retried one by one
+            self.cache.invalidate(prompt, BATCH_CODEGEN_SYSTEM)
+        return generated
+
+    async def _generate_file_code(self, semaphore: asyncio.Semaphore, task: Dict[str, Any], file_path: str, project_files: Dict[str, str]) -> str:
+        existing_content = project_files.get(file_path, "")
+        changes = task.get('changes', '')
 
-    def generate_focused_task_plan(self, user_input: str) -> Dict[str, Any]:
         prompt = f"""
-        Create a focused task plan for the following Flutter development task:
+        Implement the following task:
 
-        {user_input}
+        Task: {task.get('main_task', 'Unknown task')}
+        Subtasks: {to_json(task.get('subtasks', []))}
+        File: {file_path}
 
-        Consider the simplest possible implementation that fulfills the task requirements.
-        Only include files and changes that are absolutely necessary.
-        If the task can be accomplished by modifying existing files (e.g., main.dart), prefer that over creating new files.
-        Only include dependencies if they are absolutely necessary for the task.
+        Existing content:
+        ```dart
+        {existing_content}
+        ```
 
-        Provide a JSON object with the following structure:
-        {{
-            "files_to_create_or_update": [
-                {{
-                    "path": "lib/main.dart",
-                    "description": "Detailed description of the changes to be made to this file with as much detail as possible based on the input prompt"
-                }}
-            ],
-            "update_main_dart": {{
-                "imports_to_add": [],
-                "routes_to_add": {{}},
-                "providers_to_add": []
-            }},
-            "dependencies": []
-        }}
+        Changes to make:
+        {changes}
+        """
 
-        Be specific about the changes to be made, mentioning exact widget names, text to be displayed, and layout modifications.
-        If a section is not needed, return an empty list or object for that section.
-        Ensure the response is a valid JSON object.
+        async with semaphore:
+            response = await self.cache.aget_or_generate(prompt, self.client.agenerate, system=CODEGEN_SYSTEM)
+        return self.remove_code_markers(response['response'].strip())
+
+
+
+    def generate_focused_task_plan(self, user_input: str) -> Dict[str, Any]:
+        prompt = f"""
+        Create a focused task plan for the following Flutter development task:
+
+        {user_input}
         """
 
-        for attempt in range(self.max_retries):
-            try:
-                response = self.client.generate(prompt=prompt)
-                logger.debug(f"Raw LLM response:\n{response['response']}")
-                task_plan = json.loads(self.robust_json_correction(response['response']))
-                logger.info(f"Generated task plan: {json.dumps(task_plan, indent=2)}")
+        def parse(response: Any) -> Optional[Dict[str, Any]]:
+            task_plan = self.robust_json_correction(response['response'])
+            if all(key in task_plan for key in ['files_to_create_or_update', 'update_main_dart', 'dependencies']):
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Generated task plan: %s", to_json(task_plan, indent=True))
+                return task_plan
+            return None
 
-                if self.validate_task_plan(task_plan, user_input):
-                    return task_plan
-                else:
-                    logger.warning(f"Generated invalid task plan on attempt {attempt + 1}. Retrying...")
-            except json.JSONDecodeError as e:
-                logger.error(f"Error parsing JSON in attempt {attempt + 1}: {str(e)}")
-                logger.error(f"Problematic JSON:\n{response['response']}")
-            except Exception as e:
-                logger.error(f"Unexpected error in attempt {attempt + 1}: {str(e)}")
+        task_plan = asyncio.run(self._generate_validated(prompt, FOCUSED_SYSTEM, parse))
+        if task_plan is not None:
+            return task_plan
 
         logger.error("Max retries reached. Unable to generate a valid task plan.")
         return {}
@@ -619,22 +934,32 @@ class TaskPlanner:
         4. Use proper Flutter widgets and syntax
 
         Existing project files:
-        {json.dumps(list(project_files.keys()), indent=2)}
+        {file_list_json(project_files)}
 
         Provide only the Dart code for the file, without any markdown code block syntax.
         """
 
         try:
-            response = self.client.generate(prompt=prompt)
+            response = self._generate_persistent(prompt)
             return self.remove_code_markers(response['response'].strip())
         except Exception as e:
             logger.error(f"Error generating content for {file_path}: {str(e)}")
             return existing_content
 
     def update_main_dart(self, main_dart_content: str, updates: Dict[str, Any]) -> str:
+        # Template-shaped updates are merged directly; the LLM is only needed when that fails
+        try:
+            merged_content = self._apply_main_dart_updates(main_dart_content, updates)
+            if self._validate_main_content(merged_content) and self._is_balanced(merged_content):
+                logger.info("Applied main.dart updates without an LLM call")
+                return merged_content
+            logger.warning("Merged main.dart failed validation, falling back to the LLM")
+        except ValueError as e:
+            logger.info(f"Cannot merge main.dart updates directly ({str(e)}), falling back to the LLM")
+
         prompt = f"""
         Update the following main.dart file with these changes:
-        {json.dumps(updates, indent=2)}
+        {to_json(updates, indent=True)}
 
         Current main.dart content:
         ```dart
@@ -647,7 +972,7 @@ class TaskPlanner:
 
         for attempt in range(self.max_retries):
             try:
-                response = self.client.generate(prompt=prompt)
+                response = self._generate(prompt)
                 return self.remove_code_markers(response['response'].strip())
             except Exception as e:
                 logger.error(f"Error updating main.dart (attempt {attempt + 1}): {str(e)}")
@@ -659,31 +984,50 @@ class TaskPlanner:
         return main_dart_content
 
     def update_project_structure(self, project_root: str, generated_updates: Dict[str, str]):
-        for file_path, content in generated_updates.items():
-            full_path = os.path.join(project_root, file_path)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            with open(full_path, 'w') as f:
-                f.write(content)
-            logger.info(f"Updated file: {file_path}")
+        asyncio.run(self.update_project_structure_async(project_root, generated_updates))
+
+    async def update_project_structure_async(self, project_root: str, generated_updates: Dict[str, str]):
+        root = self._root(project_root)
+        full_paths = {file_path: root / file_path for file_path in generated_updates}
+        for directory in {str(full_path.parent) for full_path in full_paths.values()}:
+            self._ensure_dir(directory)
+
+        # Blocking writes run on the default executor so they overlap instead of queueing
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(
+            loop.run_in_executor(None, write_file_atomic, full_paths[file_path], content)
+            for file_path, content in generated_updates.items()
+        ))
+        for file_path in generated_updates:
+            logger.info("Updated file: %s", file_path)
 
     def update_pubspec_yaml(self, project_root: str, new_dependencies: List[Dict[str, str]]):
-        pubspec_path = os.path.join(project_root, 'pubspec.yaml')
+        if not new_dependencies:
+            return
+        pubspec_path = self._root(project_root) / 'pubspec.yaml'
+        # Round-trip mode edits only the dependencies map and keeps order, comments and existing packages
+        yaml = YAML()
+        yaml.preserve_quotes = True
         with open(pubspec_path, 'r') as f:
-            content = f.read()
+            pubspec = yaml.load(f)
 
-        dependencies_section = "dependencies:\n  flutter:\n    sdk: flutter\n"
+        if pubspec.get('dependencies') is None:
+            pubspec['dependencies'] = {'flutter': {'sdk': 'flutter'}}
+        dependencies = pubspec['dependencies']
+        changed = False
         for dep in new_dependencies:
             package_name = dep.get('package_name', '')
             version = dep.get('version', '')
-            if package_name and version and package_name not in ['flutter', 'dart']:
-                dependencies_section += f"  {package_name}: {version}\n"
-
-        content = re.sub(r'dependencies:.*?dev_dependencies:',
-                         dependencies_section + '\ndev_dependencies:',
-                         content, flags=re.DOTALL)
+            if package_name and version and package_name not in SDK_PACKAGES and dependencies.get(package_name) != version:
+                dependencies[package_name] = version
+                changed = True
+        if not changed:
+            logger.info("pubspec.yaml already has the requested dependencies")
+            return
 
-        with open(pubspec_path, 'w') as f:
-            f.write(content)
+        buffer = io.StringIO()
+        yaml.dump(pubspec, buffer)
+        write_file_atomic(pubspec_path, buffer.getvalue())
 
         logger.info("Updated pubspec.yaml with new dependencies")
 
@@ -694,156 +1038,143 @@ class TaskPlanner:
         {prompt}
 
         Current project structure:
-        {json.dumps(list(project_files.keys()), indent=2)}
-
-        Provide a task plan as a JSON object with the following structure:
-        {{
-            "files_to_create_or_update": [
-                {{
-                    "path": "path/to/file.dart",
-                    "description": "Description of changes or new file content"
-                }}
-            ],
-            "update_main_dart": {{
-                "imports_to_add": ["package:flutter/material.dart", "package:your_app/path/to/file.dart"],
-                "routes_to_add": {{"/route_name": "WidgetName()"}},
-                "providers_to_add": ["ChangeNotifierProvider(create: (_) => SomeProvider())"]
-            }},
-            "dependencies": ["package_name: ^version"]
-        }}
-
-        Ensure your response is valid JSON and nothing else.
-        """
-
-
-
-    def generate_specific_code(self, task: Dict[str, Any], project_files: Dict[str, str], project_root: str) -> Tuple[List[str], Dict[str, str]]:
-        new_directories = []
-        generated_updates = {}
-
-        for change in task['code_changes']:
-            file_path = change['file']
-            code_change = change['changes']
-
-            full_path = os.path.join(project_root, file_path)
-            directory = os.path.dirname(full_path)
-
-            if directory not in new_directories and not os.path.exists(directory):
-                os.makedirs(directory)
-                new_directories.append(directory)
-
-            if file_path in project_files:
-                # Update existing file
-                current_content = project_files[file_path]
-                updated_content = self.apply_code_change(current_content, code_change)
-            else:
-                # Create new file
-                updated_content = code_change
-
-            generated_updates[file_path] = updated_content
-
-        return new_directories, generated_updates
-
-    def apply_code_change(self, current_content: str, code_change: str) -> str:
-        prompt = f"""
-        Current file content:
-        ```dart
-        {current_content}
-        ```
-
-        Proposed code change:
-        ```dart
-        {code_change}
-        ```
-
-        Please integrate the proposed code change into the current file content.
-        Ensure that the changes are applied correctly and the resulting code is valid Dart/Flutter code.
-        Return the entire updated file content.
+        {file_list_json(project_files)}
         """
 
-        response = self.client.generate(prompt=prompt)
-        return response['response'].strip()
-
     def validate_task_structure(self, task: Dict[str, Any]) -> Dict[str, Any]:
         validated_task = {
             'main_task': task.get('main_task', ''),
             'subtasks': task.get('subtasks', []),
             'files': task.get('files', []),
             'changes': task.get('changes', ''),
-            'dependencies': task.get('dependencies', [])
+            'dependencies': task.get('dependencies', []),
+            'code_changes': task.get('code_changes', [])
         }
-        return validated_task
+        return self._normalize_task(validated_task)
 
     def print_detailed_task_list(self, tasks: List[Dict[str, Any]]):
-        logger.info("\nDetailed Task List:")
+        """Log tasks as produced by _normalize_task."""
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        # Build the whole listing first and emit it as one record
+        show_changes = logger.isEnabledFor(logging.DEBUG)
+        lines = ["\nDetailed Task List:"]
         for i, task in enumerate(tasks, 1):
-            logger.info(f"{i}. {task['main_task']}")
-            logger.info("   Subtasks:")
-            for subtask in task['subtasks']:
-                logger.info(f"   - {subtask}")
-            logger.info("   Files:")
-            for file in task['files']:
-                logger.info(f"   - {file}")
-            logger.info("   Dependencies to add:")
-            for dep in task['dependencies']:
-                if isinstance(dep, dict):
-                    logger.info(f"   - {dep['package']} (version: {dep['version']})")
-                else:
-                    logger.info(f"   - {dep}")
-            logger.info("   Code changes:")
+            lines.append(f"{i}. {task['main_task']}")
+            lines.append("   Subtasks:")
+            lines.extend(f"   - {subtask}" for subtask in task['subtasks'])
+            lines.append("   Files:")
+            lines.extend(f"   - {file}" for file in task['files'])
+            lines.append("   Dependencies to add:")
+            lines.extend(f"   - {dep['package']} (version: {dep['version']})" for dep in task['dependencies'])
+            lines.append("   Code changes:")
             for change in task.get('code_changes', []):
-                if isinstance(change, dict) and 'file' in change and 'changes' in change:
-                    logger.info(f"   - {change['file']}:")
-                    logger.info(f"     ```dart\n{change['changes']}\n     ```")
-                else:
-                    logger.info(f"   - {change}")
-            logger.info("")
+                if not change['file']:
+                    # Free-form change without a target file
+                    lines.append(f"   - {change['changes']}")
+                    continue
+                lines.append(f"   - {change['file']}:")
+                if show_changes:
+                    lines.append(f"     ```dart\n{change['changes']}\n     ```")
+            lines.append("")
+        logger.info("\n".join(lines))
 
     def generate_specific_code(self, task: Dict[str, Any], project_files: Dict[str, str], project_root: str) -> Tuple[List[str], Dict[str, str]]:
-        logger.info(f"Generating code for task: {task['main_task']}")
+        return asyncio.run(self.generate_specific_code_async(task, project_files, project_root))
+
+    async def generate_specific_code_async(self, task: Dict[str, Any], project_files: Dict[str, str], project_root: str) -> Tuple[List[str], Dict[str, str]]:
+        logger.info("Generating code for task: %s", task['main_task'])
         new_directories = []
         generated_updates = {}
+        files = task['files']
 
-        for file_path in task['files']:
-            full_path = os.path.join(project_root, file_path)
-            directory = os.path.dirname(full_path)
+        for file_path in files:
+            directory = str((self._root(project_root) / file_path).parent)
 
-            if directory not in new_directories and not os.path.exists(directory):
-                os.makedirs(directory)
+            if self._ensure_dir(directory):
                 new_directories.append(directory)
 
-            existing_content = project_files.get(file_path, "")
-
-            prompt = f"""
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        batch_files = files
+        if not task_has_instructions(task):
+            # With nothing to do, existing files are kept as they are and new files with a
+            # scaffold take it; only new files without one need generating
+            batch_files = [file_path for file_path in files
+                           if not project_files.get(file_path, "").strip() and scaffold_for(file_path) is None]
+        batched = await self._generate_batches(semaphore, task, batch_files, project_files)
+
+        # Task-level fields are formatted once and come before the file-specific ones,
+        # so every file prompt of the task starts with the same text
+        task_header = f"""
             Task: {task['main_task']}
-            Subtasks: {json.dumps(task['subtasks'])}
-            File: {file_path}
-
-            Existing content:
-            ```dart
-            {existing_content}
-            ```
+            Subtasks: {to_json(task['subtasks'])}
 
             Changes to make:
             {task['changes']}
+"""
 
-            Please provide the complete, updated content for this file. If it's a new file, provide the full content. If it's an existing file, incorporate the necessary changes while preserving existing functionality.
-
-            Respond with only the file content, nothing else.
-            """
-
-            response = self.client.generate(prompt=prompt)
-            updated_content = response['response'].strip()
+        # The per-file requests left over are independent, so they run together under the usual cap
+        remaining = [file_path for file_path in files if file_path not in batched]
+        results = await asyncio.gather(
+            *(self._generate_specific_file(semaphore, task, task_header, file_path, project_files.get(file_path, "")) for file_path in remaining),
+            return_exceptions=True
+        )
+        results_by_file = dict(zip(remaining, results))
+        results_by_file.update(batched)
 
-            if updated_content:
+        for file_path in files:
+            updated_content = results_by_file[file_path]
+            if isinstance(updated_content, Exception):
+                logger.error(f"Error generating code for file {file_path}: {str(updated_content)}")
+            elif updated_content:
                 generated_updates[file_path] = updated_content
-                logger.info(f"Generated content for file: {file_path}")
+                logger.info("Generated content for file: %s", file_path)
             else:
                 logger.warning(f"No content generated for file: {file_path}")
 
         return new_directories, generated_updates
 
+    async def _generate_specific_file(self, semaphore: asyncio.Semaphore, task: Dict[str, Any], task_header: str, file_path: str, existing_content: str) -> str:
+        if not task_has_instructions(task):
+            if existing_content.strip():
+                # Nothing to apply, so don't pay to send the whole file just to get it back
+                logger.info("Task has no instructions for existing file %s, keeping it as is", file_path)
+                return existing_content
+            scaffold = scaffold_for(file_path)
+            if scaffold is not None:
+                logger.info("Task has no instructions for new file %s, using the scaffold", file_path)
+                return scaffold
+        prompt = task_header + f"""
+            File: {file_path}
+
+            Existing content:
+            ```dart
+            {existing_content}
+            ```
+            """
+
+        async with semaphore:
+            response = await self._agenerate_persistent(
+                prompt, system=SPECIFIC_CODE_SYSTEM,
+                max_tokens=output_token_budget(existing_content), stop=FILE_OUTPUT_STOP_SEQUENCES
+            )
+        return response['response'].strip()
+
     def apply_code_change(self, current_content: str, code_change: str) -> str:
+        # A unified diff can be applied exactly; only prose-style changes need the LLM
+        if looks_like_unified_diff(code_change):
+            patched = apply_unified_diff(current_content, code_change)
+            if patched is not None:
+                logger.info("Applied code change as a unified diff without an LLM call")
+                return patched.strip()
+            logger.warning("Code change looked like a diff but didn't apply cleanly, asking the LLM")
+        else:
+            # New imports and new top-level classes only need appending
+            merged = merge_appendable_change(current_content, code_change)
+            if merged is not None:
+                logger.info("Applied code change as a plain addition without an LLM call")
+                return merged.strip()
+
         prompt = f"""
         Current file content:
         ```dart
@@ -852,13 +1183,9 @@ class TaskPlanner:
 
         Proposed code change:
         {code_change}
-
-        Please integrate the proposed code change into the current file content.
-        Ensure that the changes are applied correctly and the resulting code is valid Dart/Flutter code.
-        Return the entire updated file content.
         """
 
-        response = self.client.generate(prompt=prompt)
+        response = self._generate_light(prompt, system=CODE_CHANGE_SYSTEM)
         return response['response'].strip()
 
 
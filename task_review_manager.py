@@ -1,27 +1,23 @@
-import json
-import re
 import logging
 from typing import Dict, Any, Optional
+import json5
+import orjson
 from ai_client import AIClient
+from llm_cache import LLM_DISK_CACHE_DIR, LLMCache
+from task_planning import DETERMINISTIC_TEMPERATURE
+from utils import find_json_span, to_json
 
 logger = logging.getLogger(__name__)
 
-class TaskReviewManager:
-    def __init__(self, client: AIClient):
-        self.client = client
-        self.max_retries = 3
-
-    def review_task_plan(self, task_plan: Dict[str, Any], user_input: str) -> Dict[str, Any]:
-        """
-        Review and enhance task plan to ensure it fully captures user requirements.
-        """
-        prompt = """
-        Review and enhance this task plan based on the user's request.
-
-        Original User Request: """ + user_input + """
+REQUIRED_PLAN_KEYS = frozenset({'steps', 'update_main_dart', 'dependencies'})
+REQUIRED_STEP_KEYS = frozenset({'type', 'file_path', 'description'})
+VALID_STEP_TYPES = frozenset({'create_file', 'update_file', 'delete_file'})
+REQUIRED_MAIN_DART_KEYS = frozenset({'imports_to_add', 'routes_to_add', 'initial_route', 'providers_to_initialize'})
 
-        Current Task Plan:
-        """ + json.dumps(task_plan, indent=2) + """
+# The review instructions and schema are identical for every plan, so they go out as the
+# system prompt ahead of the request and plan, where the provider can reuse its cached prefix.
+REVIEW_SYSTEM = """
+        Review and enhance the given task plan based on the user's request.
 
         Review Instructions:
         1. Identify ALL specific requirements:
@@ -58,10 +54,40 @@ class TaskReviewManager:
         Respond with ONLY the enhanced JSON object.
         """
 
+class TaskReviewManager:
+    def __init__(self, client: AIClient, cache: Optional[LLMCache] = None, use_disk_cache: bool = True):
+        self.client = client
+        self.max_retries = 3
+        # Re-reviewing an unchanged plan for the same request reuses the earlier answer, across runs
+        # too: the prompt holds the request and the plan, so it addresses the review by content.
+        # Only the first attempt is cached; it runs at temperature 0, so the stored answer is the one
+        # the model would give again, and it is invalidated when it fails to parse or validate.
+        self.options = {'temperature': DETERMINISTIC_TEMPERATURE}
+        if cache is None:
+            disk_dir = LLM_DISK_CACHE_DIR if use_disk_cache else None
+            cache = LLMCache(disk_dir=disk_dir, namespace=client.model_name())
+        self.cache = cache
+
+    def review_task_plan(self, task_plan: Dict[str, Any], user_input: str) -> Dict[str, Any]:
+        """
+        Review and enhance task plan to ensure it fully captures user requirements.
+        """
+        prompt = """
+        Original User Request: """ + user_input + """
+
+        Current Task Plan:
+        """ + to_json(task_plan, indent=True) + """
+        """
+
         for attempt in range(self.max_retries):
             try:
                 logger.info(f"Reviewing task plan (attempt {attempt + 1})")
-                response = self.client.generate(prompt=prompt)
+                if attempt == 0:
+                    response = self.cache.get_or_generate(prompt, self.client.generate, system=REVIEW_SYSTEM, options=self.options)
+                else:
+                    # At temperature 0 a retry would repeat the rejected answer, so retries sample
+                    # at the default temperature and stay out of the cache
+                    response = self.client.generate(prompt=prompt, system=REVIEW_SYSTEM)
 
                 if isinstance(response, dict) and 'response' in response:
                     reviewed_plan = self.extract_json(response['response'])
@@ -76,10 +102,13 @@ class TaskReviewManager:
                 else:
                     logger.warning(f"Invalid enhanced plan generated (attempt {attempt + 1})")
 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.error(f"JSON parsing error in review (attempt {attempt + 1}): {str(e)}")
             except Exception as e:
                 logger.error(f"Error reviewing task plan (attempt {attempt + 1}): {str(e)}")
+            if attempt == 0:
+                # Don't serve the answer that just failed next time
+                self.cache.invalidate(prompt, REVIEW_SYSTEM, self.options)
 
         logger.warning("Failed to enhance task plan, returning original")
         return task_plan
@@ -88,38 +117,16 @@ class TaskReviewManager:
         """Extract JSON from text, handling various formats."""
         try:
             # First try direct JSON parsing
-            return json.loads(text)
-        except json.JSONDecodeError:
-            # Try to find JSON-like structure
-            json_pattern = r'\{[\s\S]*\}'  # Matches everything between first { and last }
-            match = re.search(json_pattern, text, re.DOTALL)
-            if match:
-                potential_json = match.group(0)
-                # Try robust correction if initial cleaning fails
-                cleaned_json = (
-                    potential_json
-                    .replace('\n', ' ')
-                    .replace('```json', '')
-                    .replace('```', '')
-                    .replace('\"', '"')
-                    .replace("'", '"')
-                )
-
-                try:
-                    return json.loads(cleaned_json)
-                except json.JSONDecodeError:
-                    # If cleaning fails, try robust correction
-                    return self.robust_json_correction(potential_json)
-
-            logger.error("No valid JSON structure found")
-            return {}
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # Find the JSON-like structure and repair it in place
+            return self.robust_json_correction(text.replace('```json', '').replace('```', ''))
 
     def validate_task_plan(self, task_plan: Dict[str, Any]) -> bool:
         """Validate the task plan has required structure."""
         try:
             # Basic structure validation
-            required_keys = ['steps', 'update_main_dart', 'dependencies']
-            if not all(key in task_plan for key in required_keys):
+            if not REQUIRED_PLAN_KEYS.issubset(task_plan):
                 logger.error("Missing required top-level keys")
                 return False
 
@@ -129,17 +136,16 @@ class TaskReviewManager:
                 return False
 
             for step in task_plan.get('steps', []):
-                if not all(key in step for key in ['type', 'file_path', 'description']):
+                if not REQUIRED_STEP_KEYS.issubset(step):
                     logger.error("Step missing required keys")
                     return False
-                if step['type'] not in ['create_file', 'update_file', 'delete_file']:
+                if step['type'] not in VALID_STEP_TYPES:
                     logger.error(f"Invalid step type: {step['type']}")
                     return False
 
             # Validate main.dart updates
             main_dart_updates = task_plan.get('update_main_dart', {})
-            required_main_keys = ['imports_to_add', 'routes_to_add', 'initial_route', 'providers_to_initialize']
-            if not all(key in main_dart_updates for key in required_main_keys):
+            if not REQUIRED_MAIN_DART_KEYS.issubset(main_dart_updates):
                 logger.error("Missing required main.dart update keys")
                 return False
 
@@ -152,24 +158,27 @@ class TaskReviewManager:
     def robust_json_correction(self, invalid_json: str) -> Dict[str, Any]:
         """Attempt to correct invalid JSON."""
         # Remove any non-JSON content before and after the main JSON structure
-        json_match = re.search(r'\{.*\}', invalid_json, re.DOTALL)
-        if not json_match:
+        span = find_json_span(invalid_json)
+        if not span:
             logger.error(f"No JSON-like structure found in: {invalid_json}")
             return {}
 
-        potential_json = json_match.group(0)
+        potential_json = invalid_json[span[0]:span[1]]
 
-        # Handle escaped quotes within JSON strings
-        potential_json = re.sub(r'(?<!\\)"([^"]*)"', lambda m: '"{}"'.format(m.group(1).replace('"', '\\"')), potential_json)
-
-        # Fix common JSON errors
-        potential_json = re.sub(r'([{,]\s*)(\w+)(\s*:)', r'\1"\2"\3', potential_json)  # Add quotes to keys
-        potential_json = re.sub(r',\s*([}\]])', r'\1', potential_json)  # Remove trailing commas
-        potential_json = potential_json.replace("'", '"')  # Replace single quotes with double quotes
+        try:
+            return orjson.loads(potential_json)
+        except orjson.JSONDecodeError:
+            pass
 
+        # json5 accepts single quotes, unquoted keys and trailing commas in one pass;
+        # raw newlines inside strings are the one slip it doesn't, so flatten those last
+        try:
+            return json5.loads(potential_json)
+        except ValueError:
+            pass
         try:
-            return json.loads(potential_json)
-        except json.JSONDecodeError as e:
+            return json5.loads(potential_json.replace('\n', ' '))
+        except ValueError as e:
             logger.error(f"JSON correction failed: {str(e)}")
             logger.error(f"Problematic JSON: {potential_json}")
             return {}
\ No newline at end of file
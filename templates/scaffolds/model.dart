@@ -0,0 +1,3 @@
+class __CLASS_NAME__ {
+  const __CLASS_NAME__();
+}
@@ -0,0 +1,4 @@
+import 'package:flutter/foundation.dart';
+
+class __CLASS_NAME__ extends ChangeNotifier {
+}
@@ -0,0 +1,10 @@
+import 'package:flutter/material.dart';
+
+class __CLASS_NAME__ extends StatelessWidget {
+  const __CLASS_NAME__({super.key});
+
+  @override
+  Widget build(BuildContext context) {
+    return const SizedBox.shrink();
+  }
+}
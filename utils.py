@@ -1,48 +1,283 @@
+import logging
+import os
+import shlex
 import subprocess
-from typing import Tuple, Union
+import threading
+from typing import Any, Iterator, List, Optional, Tuple, Union
 import re
+import orjson
 
-def run_command(command: str, capture_output: bool = True) -> Union[Tuple[str, str], subprocess.Popen]:
+logger = logging.getLogger(__name__)
+
+READER_JOIN_TIMEOUT = 5
+
+DIFF_MARKER_PATTERN = re.compile(r'^(?:--- |\+\+\+ |@@ )', re.MULTILINE)
+HUNK_HEADER_PATTERN = re.compile(r'^@@ -(\d+)(?:,\d+)? \+\d+(?:,\d+)? @@')
+DART_IMPORT_PATTERN = re.compile(r"^import\s+['\"][^'\"]+['\"][^;]*;\s*$")
+TOP_LEVEL_DECLARATION_PATTERN = re.compile(
+    r'^(?:(?:abstract|sealed|base|final|interface)\s+)*(?:class|mixin|enum|extension)\s+([A-Za-z_][A-Za-z0-9_]*)',
+    re.MULTILINE
+)
+# Every form of const strip_const_declarations removes, matched in one pass; each named group
+# holds the text that replaces the whole match
+CONST_DECLARATION_PATTERN = re.compile(
+    r'const\s+(?:'
+    r'(?P<constructor>[A-Z_][A-Za-z0-9_]*\()'
+    r'|(?P<named_constructor>[A-Z_][A-Za-z0-9_]*\.[A-Za-z0-9_]+\()'
+    r'|(?P<literal>[\[{])'
+    r'|(?P<variable>[A-Za-z0-9_<>]+\s+[A-Za-z0-9_]+\s*=)'
+    r')'
+)
+
+# Generated, vendored and platform directories that never hold the app's Dart sources
+SKIPPED_DIRECTORIES = frozenset({
+    '.dart_tool', 'build', '.git', '.idea', '.vscode', 'ios', 'android', 'macos',
+    'windows', 'linux', 'web', 'test', '.pub-cache', 'node_modules'
+})
+
+def _echo_lines(pipe, lines: List[str]):
+    for line in iter(pipe.readline, ''):
+        # Flutter output can run to megabytes; only format it when debug logging is on
+        logger.debug("%s", line.rstrip('\n'))
+        lines.append(line)
+    pipe.close()
+
+def run_command(command: str, capture_output: bool = True, timeout: Optional[float] = None) -> Union[Tuple[str, str], subprocess.Popen]:
     """
-    Run a shell command and return its output and error.
+    Run a command without a shell and return its output and error.
+    Output is logged line by line at debug level while the command runs.
+    With timeout set, the command is killed after that many seconds; by default it may run as long as it needs.
     """
-    print(f"Running command: {command}")
+    logger.info("Running command: %s", command)
+    args = shlex.split(command)
     if capture_output:
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, text=True)
-        output, error = process.communicate()
-        print(f"Command output: {output}")
-        print(f"Command error: {error}")
+        try:
+            process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1)
+        except FileNotFoundError:
+            # Mirror the shell's message so callers can keep checking for it
+            return "", f"{args[0]}: command not found"
+        output_lines: List[str] = []
+        error_lines: List[str] = []
+        readers = [threading.Thread(target=_echo_lines, args=(process.stdout, output_lines), daemon=True),
+                   threading.Thread(target=_echo_lines, args=(process.stderr, error_lines), daemon=True)]
+        for reader in readers:
+            reader.start()
+        timed_out = False
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            timed_out = True
+        for reader in readers:
+            # Children of a killed command can keep the pipes open, so don't wait on them forever
+            reader.join(timeout=READER_JOIN_TIMEOUT if timed_out else None)
+        output, error = ''.join(output_lines), ''.join(error_lines)
+        if timed_out:
+            error += f"\nCommand timed out after {timeout} seconds"
         return output, error
     else:
-        process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
         return process
 
+def to_json(obj: Any, indent: bool = False) -> str:
+    """
+    Serialize obj with orjson, indenting by two spaces like json.dumps(indent=2) when asked.
+    """
+    option = orjson.OPT_INDENT_2 if indent else 0
+    return orjson.dumps(obj, option=option).decode('utf-8')
+
+def strip_code_fences(content: str) -> str:
+    """
+    Remove markdown code fences (```dart / ```) that LLMs wrap around generated code.
+    """
+    content = content.strip()
+    if content.startswith("```dart"):
+        content = content[7:].lstrip()
+    elif content.startswith("```"):
+        content = content[3:].lstrip()
+    if content.endswith("```"):
+        content = content[:-3].rstrip()
+    if "```" in content:
+        # Fences in the middle of the text, e.g. after a line of prose
+        content = content.replace("```dart", "").replace("```", "").strip()
+    return content
+
+def find_json_span(text: str) -> Optional[Tuple[int, int]]:
+    """
+    Return (start, end) of the first balanced {...} object in text, skipping braces inside
+    double-quoted strings, or None when there is no complete object.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return start, index + 1
+    return None
+
 def truncate_context(context: str, max_length: int) -> str:
     """
-    Truncate the context to fit within the maximum length.
+    Truncate the context to fit within the maximum length, keeping its head and tail.
+    Both cuts fall on line boundaries, and the head depends only on the start of the
+    context and max_length, so prompts built on it keep a stable prefix.
     """
     if len(context) <= max_length:
         return context
-    truncated = context[:max_length // 2] + "\n...\n" + context[-max_length // 2:]
+    half = max_length // 2
+    head = context[:half]
+    head = head[:head.rfind('\n') + 1] or head
+    tail = context[len(context) - half:]
+    newline = tail.find('\n')
+    tail = tail[newline + 1:] if newline != -1 and newline + 1 < len(tail) else tail
+    truncated = head + "\n...\n" + tail
     print(f"Context truncated from {len(context)} to {len(truncated)} characters.")
     return truncated
 
+def walk_dart_files(root_dir: str) -> Iterator[str]:
+    """
+    Yield the path of every Dart file under root_dir, pruning SKIPPED_DIRECTORIES at walk time.
+    """
+    for root, dirs, files in os.walk(root_dir):
+        dirs[:] = [d for d in dirs if d not in SKIPPED_DIRECTORIES]
+        for file in files:
+            if file.endswith('.dart'):
+                yield os.path.join(root, file)
 
+def write_file_atomic(path: Union[str, os.PathLike], content: str) -> bool:
+    """
+    Write content to path through a temporary file and os.replace, so readers never see a partial file.
+    Returns False without touching the file when it already holds the same content.
+    """
+    data = content.encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
 
-def strip_const_declarations(code: str) -> str:
+    tmp_path = f"{os.fspath(path)}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def looks_like_unified_diff(text: str) -> bool:
+    # The markers show up within the first few lines of any real diff
+    return bool(DIFF_MARKER_PATTERN.search(text[:200]))
+
+def apply_unified_diff(original: str, diff: str) -> Optional[str]:
     """
-    Remove const declarations from Dart code while preserving the rest of the code structure.
+    Apply a unified diff to original and return the patched text.
+    Hunks are matched on their context and removed lines, starting at the line the header
+    gives and otherwise anywhere in the file. Returns None if any hunk doesn't apply.
     """
-    # Remove const from const constructor calls - matches "const ClassName(" or "const _ClassName("
-    code = re.sub(r'const\s+([A-Z_][A-Za-z0-9_]*)\(', r'\1(', code)
+    lines = original.split('\n')
+    hunks = []
+    for line in diff.split('\n'):
+        header = HUNK_HEADER_PATTERN.match(line)
+        if header:
+            hunks.append((int(header.group(1)) - 1, [], []))
+        elif hunks and line[:1] in (' ', '-', '+', ''):
+            _, old_lines, new_lines = hunks[-1]
+            marker, text = line[:1], line[1:]
+            if marker != '+':
+                old_lines.append(text)
+            if marker != '-':
+                new_lines.append(text)
+    if not hunks:
+        return None
 
-    # Remove const from const variable declarations - matches "const value =" or "const List<type>"
-    code = re.sub(r'const\s+([A-Za-z0-9_<>]+\s+[A-Za-z0-9_]+\s*=)', r'\1', code)
+    offset = 0
+    for start, old_lines, new_lines in hunks:
+        # A blank line at the end of a hunk is usually just the diff's trailing newline
+        while old_lines and new_lines and old_lines[-1] == '' and new_lines[-1] == '':
+            old_lines.pop()
+            new_lines.pop()
+        size = len(old_lines)
+        expected = max(start + offset, 0)
+        candidates = [expected] + [i for i in range(len(lines) - size + 1) if i != expected]
+        position = next((i for i in candidates if lines[i:i + size] == old_lines), None)
+        if position is None:
+            return None
+        lines[position:position + size] = new_lines
+        offset = position - start + len(new_lines) - size
+    return '\n'.join(lines)
 
-    # Remove const from const collection literals - matches "const [" or "const {"
-    code = re.sub(r'const\s+(\[|\{)', r'\1', code)
+def merge_appendable_change(current: str, change: str) -> Optional[str]:
+    """
+    Merge a change that only adds imports and/or new top-level declarations (classes, mixins,
+    enums, extensions) to current: missing imports go after the existing ones and the
+    declarations are appended. Returns None when the change does anything else or declares
+    a name current already declares, so the caller can fall back to a real merge.
+    An empty current simply takes the change.
+    """
+    change = strip_code_fences(change)
+    lines = change.split('\n')
+    index = 0
+    imports = []
+    while index < len(lines) and (not lines[index].strip() or DART_IMPORT_PATTERN.match(lines[index])):
+        if lines[index].strip():
+            imports.append(lines[index].strip())
+        index += 1
+    body = '\n'.join(lines[index:]).strip()
+    if body:
+        # Every unindented line has to belong to a declaration, not a statement or a member
+        for line in body.split('\n'):
+            if line and not line[0].isspace() and not (
+                TOP_LEVEL_DECLARATION_PATTERN.match(line) or line.startswith(('}', '@', '//', '/*', '*'))
+            ):
+                return None
+        names = TOP_LEVEL_DECLARATION_PATTERN.findall(body)
+        if not names or body.count('{') != body.count('}'):
+            return None
+        if set(names) & set(TOP_LEVEL_DECLARATION_PATTERN.findall(current)):
+            return None
+    if not imports and not body:
+        return None
+    if not current.strip():
+        return change
 
-    # Remove const from named constructor calls - matches "const ClassName.named("
-    code = re.sub(r'const\s+([A-Z_][A-Za-z0-9_]*\.[A-Za-z0-9_]+\()', r'\1', code)
+    current_lines = current.rstrip().split('\n')
+    existing = {line.strip() for line in current_lines}
+    missing = [line for line in dict.fromkeys(imports) if line not in existing]
+    if missing:
+        last_import = max((i for i, line in enumerate(current_lines) if DART_IMPORT_PATTERN.match(line)), default=-1)
+        current_lines[last_import + 1:last_import + 1] = missing
+    merged = '\n'.join(current_lines)
+    if body:
+        merged += '\n\n' + body
+    return merged
 
-    return code
\ No newline at end of file
+def strip_const_declarations(code: str) -> str:
+    """
+    Remove const declarations from Dart code while preserving the rest of the code structure.
+    Handles const constructor calls ("const ClassName(", "const ClassName.named("),
+    const collection literals ("const [", "const {") and const variable declarations
+    ("const value =", "const List<type> name =").
+    """
+    return CONST_DECLARATION_PATTERN.sub(lambda match: match.group(match.lastgroup), code)